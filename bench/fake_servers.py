@@ -0,0 +1,257 @@
+import re
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+R53_XMLNS = "https://route53.amazonaws.com/doc/2013-04-01/"
+NS = "{" + R53_XMLNS + "}"
+
+# Route53's limits on a single ChangeResourceRecordSets call
+MAX_CHANGES = 1000
+MAX_VALUE_CHARACTERS = 32000
+DEFAULT_MAXITEMS = 300
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Benchmarks open connections faster than the default backlog of 5 can take
+    request_queue_size = 128
+
+
+class _FakeServer:
+    def __init__(self, handler):
+        self.server = _Server(("127.0.0.1", 0), handler)
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes, Nagle would hold the body for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body, content_type="text/xml"):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Answers every GET with the configured address as text, after latency seconds
+class FakeIPEcho(_FakeServer):
+    def __init__(self, ip="203.0.113.10", latency=0.0):
+        super().__init__(_IPEchoHandler)
+        self.ip = ip
+        self.latency = latency
+        self.requests = 0
+
+
+class _IPEchoHandler(_QuietHandler):
+    def do_GET(self):
+        fake = self.server.fake
+        fake.requests += 1
+        if fake.latency:
+            time.sleep(fake.latency)
+        self.reply(200, fake.ip + "\n", "text/plain")
+
+
+# In-memory Route53 speaking the XML API for ListResourceRecordSets, ChangeResourceRecordSets,
+# GetChange and GetHostedZone. Every request is delayed by latency seconds, requests beyond
+# throttle_rate per second get Throttling like the real service, and changes turn INSYNC
+# insync_delay seconds after they are submitted. Signatures are not checked.
+class FakeRoute53(_FakeServer):
+    def __init__(self, latency=0.0, throttle_rate=None, insync_delay=0.0):
+        super().__init__(_Route53Handler)
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.insync_delay = insync_delay
+        self.zones = {}
+        self.changes = {}
+        self.calls = {}
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self._tokens = throttle_rate or 0
+        self._updated = time.monotonic()
+
+    def add_zone(self, zone_id, name):
+        self.zones[zone_id] = {"name": name, "rrsets": {}}
+
+    def set_record(self, zone_id, name, record_type, values, ttl=300):
+        self.zones[zone_id]["rrsets"][(name, record_type)] = (ttl, list(values))
+
+    def get_record(self, zone_id, name, record_type):
+        return self.zones[zone_id]["rrsets"].get((name, record_type))
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = {}
+            self.throttled = 0
+
+    def _admit(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            if not self.throttle_rate:
+                return True
+            now = time.monotonic()
+            self._tokens = min(self.throttle_rate, self._tokens + (now - self._updated) * self.throttle_rate)
+            self._updated = now
+            if self._tokens < 1:
+                self.throttled += 1
+                return False
+            self._tokens -= 1
+            return True
+
+
+def _sort_key(name, record_type):
+    # Route53 lists names with their labels reversed, example.com. before www.example.com.
+    return tuple(reversed(name.rstrip(".").split("."))), record_type
+
+
+class _Route53Handler(_QuietHandler):
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        path, _, query = self.path.partition("?")
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        routes = [
+            ("GET", r"/2013-04-01/hostedzone/([^/]+)/rrset", "ListResourceRecordSets", self._list),
+            ("POST", r"/2013-04-01/hostedzone/([^/]+)/rrset", "ChangeResourceRecordSets", self._change),
+            ("GET", r"/2013-04-01/change/([^/]+)", "GetChange", self._get_change),
+            ("GET", r"/2013-04-01/hostedzone/([^/]+)", "GetHostedZone", self._get_zone),
+        ]
+        for route_method, pattern, operation, handler in routes:
+            match = re.fullmatch(pattern, path)
+            if route_method == method and match:
+                break
+        else:
+            return self._error(404, "NotFound", f"no such operation {method} {path}")
+
+        if fake.latency:
+            time.sleep(fake.latency)
+        if not fake._admit(operation):
+            return self._error(400, "Throttling", "Rate exceeded")
+        with fake.lock:
+            handler(match.group(1), dict(parse_qsl(query)), body)
+
+    def _error(self, status, code, message):
+        self.reply(status, f'<?xml version="1.0"?>\n<ErrorResponse xmlns="{R53_XMLNS}"><Error>'
+                           f'<Type>Sender</Type><Code>{code}</Code><Message>{escape(message)}</Message>'
+                           f'</Error><RequestId>bench</RequestId></ErrorResponse>')
+
+    def _zone(self, zone_id):
+        zone = self.server.fake.zones.get(zone_id)
+        if zone is None:
+            self._error(404, "NoSuchHostedZone", f"No hosted zone found with ID: {zone_id}")
+        return zone
+
+    def _list(self, zone_id, params, body):
+        zone = self._zone(zone_id)
+        if zone is None:
+            return
+        maxitems = int(params.get("maxitems", DEFAULT_MAXITEMS))
+        start = _sort_key(params["name"], params.get("type", "")) if "name" in params else None
+        keys = sorted(zone["rrsets"], key=lambda key: _sort_key(*key))
+        if start is not None:
+            keys = [key for key in keys if _sort_key(*key) >= start]
+
+        parts = [f'<?xml version="1.0"?>\n<ListResourceRecordSetsResponse xmlns="{R53_XMLNS}"><ResourceRecordSets>']
+        for name, record_type in keys[:maxitems]:
+            ttl, values = zone["rrsets"][(name, record_type)]
+            records = "".join(f"<ResourceRecord><Value>{escape(value)}</Value></ResourceRecord>" for value in values)
+            parts.append(f"<ResourceRecordSet><Name>{escape(name)}</Name><Type>{record_type}</Type>"
+                         f"<TTL>{ttl}</TTL><ResourceRecords>{records}</ResourceRecords></ResourceRecordSet>")
+        parts.append("</ResourceRecordSets>")
+        if len(keys) > maxitems:
+            name, record_type = keys[maxitems]
+            parts.append(f"<IsTruncated>true</IsTruncated><NextRecordName>{escape(name)}</NextRecordName>"
+                         f"<NextRecordType>{record_type}</NextRecordType>")
+        else:
+            parts.append("<IsTruncated>false</IsTruncated>")
+        parts.append(f"<MaxItems>{maxitems}</MaxItems></ListResourceRecordSetsResponse>")
+        self.reply(200, "".join(parts))
+
+    def _change(self, zone_id, params, body):
+        fake = self.server.fake
+        zone = self._zone(zone_id)
+        if zone is None:
+            return
+        changes = []
+        characters = 0
+        for change in ElementTree.fromstring(body).iter(NS + "Change"):
+            rrset = change.find(NS + "ResourceRecordSet")
+            values = [value.text for value in rrset.iter(NS + "Value")]
+            action = change.findtext(NS + "Action")
+            # UPSERT values count twice towards the limits
+            characters += sum(map(len, values)) * (2 if action == "UPSERT" else 1)
+            changes.append((action, rrset.findtext(NS + "Name"), rrset.findtext(NS + "Type"),
+                            int(rrset.findtext(NS + "TTL") or 0), values))
+        if len(changes) > MAX_CHANGES or characters > MAX_VALUE_CHARACTERS:
+            return self._error(400, "InvalidChangeBatch",
+                               f"{len(changes)} changes with {characters} value characters exceed the limits")
+
+        rrsets = dict(zone["rrsets"])
+        for action, name, record_type, ttl, values in changes:
+            key = (name, record_type)
+            if action == "CREATE" and key in rrsets:
+                return self._error(400, "InvalidChangeBatch", f"{name} {record_type} already exists")
+            if action == "DELETE":
+                if rrsets.get(key) != (ttl, values):
+                    return self._error(400, "InvalidChangeBatch", f"{name} {record_type} not found as given")
+                del rrsets[key]
+            else:
+                rrsets[key] = (ttl, values)
+        zone["rrsets"] = rrsets
+
+        change_id = f"C{len(fake.changes) + 1:012d}"
+        fake.changes[change_id] = time.monotonic()
+        self._reply_change("ChangeResourceRecordSetsResponse", change_id)
+
+    def _get_change(self, change_id, params, body):
+        if change_id not in self.server.fake.changes:
+            return self._error(404, "NoSuchChange",
+                               f"A change with the specified change ID does not exist: {change_id}")
+        self._reply_change("GetChangeResponse", change_id)
+
+    def _reply_change(self, response, change_id):
+        fake = self.server.fake
+        status = "INSYNC" if time.monotonic() - fake.changes[change_id] >= fake.insync_delay else "PENDING"
+        self.reply(200, f'<?xml version="1.0"?>\n<{response} xmlns="{R53_XMLNS}"><ChangeInfo>'
+                        f"<Id>/change/{change_id}</Id><Status>{status}</Status>"
+                        f"<SubmittedAt>2026-01-01T00:00:00.000Z</SubmittedAt></ChangeInfo></{response}>")
+
+    def _get_zone(self, zone_id, params, body):
+        zone = self._zone(zone_id)
+        if zone is None:
+            return
+        nameservers = "".join(f"<NameServer>ns-{i}.awsdns-bench.net</NameServer>" for i in range(4))
+        self.reply(200, f'<?xml version="1.0"?>\n<GetHostedZoneResponse xmlns="{R53_XMLNS}"><HostedZone>'
+                        f"<Id>/hostedzone/{zone_id}</Id><Name>{escape(zone['name'])}</Name></HostedZone>"
+                        f"<DelegationSet><NameServers>{nameservers}</NameServers></DelegationSet>"
+                        f"</GetHostedZoneResponse>")
+
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# Measures what a check costs against in-process stand-ins for Route53 and an IP echo
+# service, nothing leaves the host:
+#
+#   python bench/run_bench.py --sizes 1,100,10000 --r53-latency 0.02 --json results.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ddns  # noqa: E402
+from fake_servers import FakeIPEcho, FakeRoute53  # noqa: E402
+
+ZONE_SIZE = 100
+OLD_IP = "198.51.100.1"
+IPS = ("203.0.113.10", "203.0.113.11")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ddns.py against fake Route53 and IP echo servers")
+    parser.add_argument("--cold-runs", type=int, default=10, help="One-shot runs of the script")
+    parser.add_argument("--warm-checks", type=int, default=50, help="Checks of one embedded, long lived Updater")
+    parser.add_argument("--sizes", default="1,100,10000", help="Comma separated record counts to sync")
+    parser.add_argument("--sync-repeat", type=int, default=3, help="Syncs per record count")
+    parser.add_argument("--r53-latency", type=float, default=0.0, help="Seconds added to every Route53 call")
+    parser.add_argument("--r53-throttle", type=float, default=None,
+                        help="Route53 calls per second before Throttling, unlimited by default")
+    parser.add_argument("--echo-latency", type=float, default=0.0, help="Seconds added to every IP lookup")
+    parser.add_argument("--r53-rate", type=float, default=1000, help="--r53-rate passed to ddns.py")
+    parser.add_argument("--r53-concurrency", type=int, default=16, help="--r53-concurrency passed to ddns.py")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args()
+
+
+def percentile(samples, p):
+    # Nearest rank
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(name, durations, calls, rss_kb, **extra):
+    result = {"name": name, "runs": len(durations), "p50": percentile(durations, 50),
+              "p99": percentile(durations, 99), "calls": calls, "rss_kb": rss_kb}
+    result.update(extra)
+    calls_text = ", ".join(f"{operation} {count}" for operation, count in sorted(calls.items())) or "none"
+    print(f"{name}: p50 {result['p50'] * 1000:.1f}ms p99 {result['p99'] * 1000:.1f}ms "
+          f"over {len(durations)} runs, max RSS {rss_kb / 1024:.1f}MiB, Route53 calls: {calls_text}")
+    return result
+
+
+def ddns_options(args, route53, echo):
+    return ["--r53-endpoint", route53.url, "--r53-rate", str(args.r53_rate),
+            "--r53-concurrency", str(args.r53_concurrency), "-a", "bench", "-s", "bench",
+            "-q", echo.url, "-6", "iface://lo"]
+
+
+def per_run(calls, runs):
+    return {operation: count / runs for operation, count in calls.items()}
+
+
+def bench_cold(args, route53, echo):
+    # The whole script in a fresh interpreter, imports and connection setup included, as cron runs it
+    route53.add_zone("ZCOLD", "cold.bench.example.")
+    command = [sys.executable, os.path.join(ROOT, "ddns.py"), "-z", "ZCOLD", "-d", "host.cold.bench.example."]
+    command += ddns_options(args, route53, echo)
+    route53.reset_counters()
+    durations, peak = [], 0
+    for _ in range(args.cold_runs):
+        route53.set_record("ZCOLD", "host.cold.bench.example.", "A", [OLD_IP])
+        start = time.monotonic()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, status, usage = os.wait4(process.pid, 0)
+        durations.append(time.monotonic() - start)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode:
+            sys.exit(f"cold run failed: {process.stderr.read().decode()}")
+        process.stderr.close()
+        peak = max(peak, usage.ru_maxrss)
+    return summarize("cold one-shot update", durations, per_run(route53.calls, args.cold_runs), peak)
+
+
+def bench_warm(args, route53, echo):
+    # One Updater kept between checks, as the daemon does: nothing to import, connections kept alive
+    route53.add_zone("ZWARM", "warm.bench.example.")
+    route53.set_record("ZWARM", "host.warm.bench.example.", "A", [IPS[0]])
+    echo.ip = IPS[0]
+    updater = ddns.Updater(ddns.parse_args(["-z", "ZWARM", "-d", "host.warm.bench.example."]
+                                           + ddns_options(args, route53, echo)))
+    updater.sync()
+
+    results = []
+    for name, flip in (("warm daemon check", False), ("warm daemon update", True)):
+        route53.reset_counters()
+        durations = []
+        for i in range(args.warm_checks):
+            if flip:
+                echo.ip = IPS[(i + 1) % 2]
+            start = time.monotonic()
+            updater.sync()
+            durations.append(time.monotonic() - start)
+        results.append(summarize(name, durations, per_run(route53.calls, args.warm_checks), max_rss()))
+    return results
+
+
+def bench_sync(args, route53, echo, size, directory):
+    # size records spread over zones of ZONE_SIZE, all changed at once, then checked again unchanged
+    records = []
+    for i in range(size):
+        zone_id = f"ZSYNC{size}N{i // ZONE_SIZE}"
+        if zone_id not in route53.zones:
+            route53.add_zone(zone_id, f"z{i // ZONE_SIZE}.sync{size}.bench.example.")
+        fqdn = f"h{i}.{route53.zones[zone_id]['name']}"
+        route53.set_record(zone_id, fqdn, "A", [OLD_IP])
+        records.append({"zone_id": zone_id, "fqdn": fqdn, "type": "A"})
+    path = os.path.join(directory, f"records-{size}.json")
+    with open(path, "w") as f:
+        json.dump({"ttl": 60, "records": records}, f)
+
+    updater = ddns.Updater(ddns.parse_args(["--config", path] + ddns_options(args, route53, echo)))
+    results = []
+    for name, flip in ((f"sync {size} records, all changed", True), (f"sync {size} records, unchanged", False)):
+        route53.reset_counters()
+        durations = []
+        for i in range(args.sync_repeat):
+            if flip:
+                echo.ip = IPS[i % 2]
+            start = time.monotonic()
+            outcome = updater.sync()
+            durations.append(time.monotonic() - start)
+            errors = [result for result in outcome if result.status == "error"]
+            if errors:
+                sys.exit(f"{name}: {len(errors)} errors, first {errors[0].error!r}")
+        results.append(summarize(name, durations, per_run(route53.calls, args.sync_repeat), max_rss(),
+                                 records=size, throttled=route53.throttled))
+    return results
+
+
+def max_rss():
+    # Peak of this process so far, in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    args = parse_args()
+    route53 = FakeRoute53(latency=args.r53_latency, throttle_rate=args.r53_throttle).start()
+    echo = FakeIPEcho(IPS[0], latency=args.echo_latency).start()
+
+    results = []
+    try:
+        if args.cold_runs:
+            results.append(bench_cold(args, route53, echo))
+        if args.warm_checks:
+            results.extend(bench_warm(args, route53, echo))
+        with tempfile.TemporaryDirectory() as directory:
+            for size in (int(size) for size in args.sizes.split(",") if size.strip()):
+                results.extend(bench_sync(args, route53, echo, size, directory))
+    finally:
+        route53.stop()
+        echo.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,143 @@
-import os
-import sys
-import argparse
-from datetime import datetime
-import requests
-from boto.route53.connection import Route53Connection
-from boto.route53.record import ResourceRecordSets
+import time
+
+# Before any other import, so --log-format json can tell what importing costs
+STARTED = time.monotonic()
+
+import os  # noqa: E402
+import sys  # noqa: E402
+import json  # noqa: E402
+import queue  # noqa: E402
+import random  # noqa: E402
+import socket  # noqa: E402
+import select  # noqa: E402
+import struct  # noqa: E402
+import argparse  # noqa: E402
+import tempfile  # noqa: E402
+import threading  # noqa: E402
+import ipaddress  # noqa: E402
+from bisect import bisect_left  # noqa: E402
+from collections import deque, namedtuple  # noqa: E402
+from datetime import datetime, timezone  # noqa: E402
+from urllib.parse import parse_qs, quote, urlsplit  # noqa: E402
+
+DEFAULT_TTL = 10
+
+RECORD_TYPES = ("A", "AAAA")
+IP_VERSIONS = {"A": 4, "AAAA": 6}
+
+# Binding to the wildcard address of one family makes the connection fail over any other,
+# so each lookup really goes out over IPv4 or IPv6
+SOURCE_ADDRESSES = {4: ("0.0.0.0", 0), 6: ("::", 0)}
+
+# Where route:// providers look up a route to when no destination is given
+ROUTE_DESTINATIONS = {4: "1.1.1.1", 6: "2606:4700:4700::1111"}
+
+SIOCGIFADDR = 0x8915
+# /proc/net/if_inet6 flags of addresses that shouldn't be published
+IFA_F_TEMPORARY = 0x01
+IFA_F_DEPRECATED = 0x20
+IFA_F_TENTATIVE = 0x40
+
+HTTP_SCHEMES = ("http", "https")
+
+# RFC 5389 Binding Request, retransmitted with a doubling interval until the timeout
+STUN_DEFAULT_PORT = 3478
+STUN_BINDING_REQUEST = 0x0001
+STUN_BINDING_SUCCESS = 0x0101
+STUN_MAGIC_COOKIE = 0x2112A442
+STUN_MAPPED_ADDRESS = 0x0001
+STUN_XOR_MAPPED_ADDRESS = 0x0020
+STUN_INITIAL_RTO = 0.5
+
+# Hedging waits for the p95 of the primary provider's recent latencies, once there are enough
+LATENCY_WINDOW = 100
+MIN_HEDGE_SAMPLES = 20
+
+# Ranking keeps an EWMA of each provider's latency and failure rate, a failure is expected to
+# cost a timeout. Once the oldest figures of a fallback provider are RANK_PROBE_AGE seconds
+# old it is queried in the background so a provider that recovered can climb back up. The
+# figures are dated in wall clock time and kept in the state file, so one-shot runs probe too.
+EWMA_ALPHA = 0.2
+RANK_PROBE_AGE = 600
+
+# GetChange polling backs off exponentially from the first to the last delay
+WAIT_INITIAL_DELAY = 2
+WAIT_MAX_DELAY = 20
+WAIT_MAX_CONCURRENCY = 8
+
+# rtnetlink multicast groups and messages for interface address changes
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RT_SCOPE_UNIVERSE = 0
+NETLINK_SETTLE = 1
+
+# Idle keep-alive connections kept per provider host
+POOL_MAXSIZE = 4
+
+# Zones with at least this many records to read are read a page (up to 300 record sets) at a
+# time instead of one ListResourceRecordSets call per record. The pages of a zone are read one
+# after the other, fewer records are quicker read all at once.
+ZONE_READ_MIN_RECORDS = 10
+
+# account is the name of an entry under "accounts" in the config, None for the command line credentials
+Record = namedtuple("Record", ["zone_id", "fqdn", "type", "ttl", "account"], defaults=[None])
+
+# What a check found for one record, status is one of skipped (no address of its family),
+# cached, unchanged, unstable, pending (needs an update, check() only), updated or error
+Result = namedtuple("Result", ["record", "status", "current", "new", "change_id", "detail", "error"],
+                    defaults=[None, None, None, None, None])
+
+R53_ENDPOINT = "https://route53.amazonaws.com"
+R53_REGION = "us-east-1"
+R53_SERVICE = "route53"
+R53_API_VERSION = "2013-04-01"
+R53_XMLNS = "{https://route53.amazonaws.com/doc/2013-04-01/}"
+R53_READ_TIMEOUT = 30
+
+# Errors worth retrying, with decorrelated jitter backoff between the base and the cap
+R53_RETRY_CODES = ("Throttling", "PriorRequestNotComplete", "ServiceUnavailable", "InternalFailure")
+R53_RETRY_BASE = 0.5
+R53_RETRY_CAP = 20
+
+# ChangeResourceRecordSets limits per batch, an UPSERT's values count twice
+R53_MAX_CHANGES = 1000
+R53_MAX_VALUES = 1000
+R53_MAX_VALUE_CHARACTERS = 32000
+
+RRSet = namedtuple("RRSet", ["name", "type", "ttl", "values", "set_identifier", "alias"],
+                   defaults=[None, False])
+ChangeInfo = namedtuple("ChangeInfo", ["id", "status"])
+HostedZone = namedtuple("HostedZone", ["id", "name", "nameservers"])
+
+DNS_TYPES = {"A": 1, "NS": 2, "CNAME": 5, "TXT": 16, "AAAA": 28}
+DNS_NOERROR = 0
+DNS_NXDOMAIN = 3
+
+DNSAnswer = namedtuple("DNSAnswer", ["name", "type", "ttl", "value"])
+DNSResponse = namedtuple("DNSResponse", ["id", "authoritative", "truncated", "rcode", "answers"])
+
+# Everything --metrics-port exports, in the order it is exported
+METRICS = {
+    "ddns_check_seconds": ("histogram", "Duration of a whole check"),
+    "ddns_check_phase_seconds": ("histogram", "Duration of each phase of a check, discover, read, commit and "
+                                              "wait (from submission to INSYNC)"),
+    "ddns_provider_latency_seconds": ("histogram", "Duration of successful IP provider lookups"),
+    "ddns_provider_errors_total": ("counter", "Failed IP provider lookups"),
+    "ddns_route53_calls_total": ("counter", "Route53 API calls, retries included"),
+    "ddns_route53_throttles_total": ("counter", "Route53 API calls that were throttled"),
+    "ddns_route53_retries_total": ("counter", "Route53 API calls that were retried"),
+    "ddns_records_total": ("counter", "Records checked, by outcome"),
+    "ddns_record_last_change_timestamp_seconds": ("gauge", "When a record was last updated, as a Unix timestamp"),
+}
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Functions and allocation sites listed in the --profile text reports
+PROFILE_TOP = 30
+# Before 3.12 cProfile only sees the thread that enabled it, from 3.12 on (sys.monitoring) it
+# sees them all and a second profiler can't be enabled at the same time
+PROFILE_PER_THREAD = sys.version_info < (3, 12)
 
 # Cribbed environment variable argparse action. Credit to Russell Heilling
 
@@ -23,48 +156,2122 @@ class EnvDefault(argparse.Action):
         setattr(namespace, self.dest, values)
 
 
-def main():
+# Same idea for on/off flags, any of "1", "true", "yes", "on" in the environment enables it
+
+
+class EnvFlag(argparse.Action):
+    def __init__(self, envvar, default=False, **kwargs):
+        if envvar:
+            if envvar in os.environ:
+                default = os.environ[envvar].strip().lower() in ("1", "true", "yes", "on")
+        super().__init__(default=default, nargs=0, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, True)
+
 
-    # Parse the args
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description='Update a AWS Route53 record with the current internet IP. \
                 Accepts all arguments as command-line flags or environment variables.')
     parser.add_argument("-q", "--ip-query-url", action=EnvDefault, envvar="IP_QUERY_URL",
-                        required=False, default="https://wtfismyip.com/text",
-                        help="URL to query to get IP")
+                        required=False, default="https://ipv4.wtfismyip.com/text",
+                        help="URL to query to get IP. Several comma separated URLs are queried \
+                              concurrently and the first valid answer wins. iface://NAME reads the \
+                              address of a local interface and route://DESTINATION the source \
+                              address of the route to DESTINATION, without any request. \
+                              stun://HOST[:PORT] asks a STUN server in a single UDP round trip and \
+                              dns://SERVER/NAME[?type=TXT] resolves a what-is-my-IP name such as \
+                              dns://resolver1.opendns.com/myip.opendns.com")
+    parser.add_argument("-6", "--ipv6-query-url", action=EnvDefault, envvar="IPV6_QUERY_URL",
+                        required=False, default="https://ipv6.wtfismyip.com/text",
+                        help="Same as --ip-query-url, for the IPv6 address of AAAA records")
+    parser.add_argument("--ip-strategy", action=EnvDefault, envvar="IP_STRATEGY", required=False,
+                        default="race", choices=["race", "hedge", "ranked", "quorum"],
+                        help="With several --ip-query-url providers, either query all of them at \
+                              once (race), the first one and only the next ones if it hasn't \
+                              answered within the hedge delay (hedge), one at a time, fastest \
+                              and most reliable so far first (ranked), or all of them at once \
+                              until --quorum of them agree (quorum)")
+    parser.add_argument("--quorum", action=EnvDefault, envvar="QUORUM", type=int, required=False,
+                        default=2, help="How many providers must agree with --ip-strategy quorum")
+    parser.add_argument("--hedge-delay", action=EnvDefault, envvar="HEDGE_DELAY", type=float,
+                        required=False, default=0.5,
+                        help="Seconds to wait before hedging until enough latencies have been \
+                              seen to use the primary provider's p95 instead")
+    parser.add_argument("--connect-timeout", action=EnvDefault, envvar="CONNECT_TIMEOUT",
+                        type=float, required=False, default=3.05,
+                        help="Seconds to wait for a connection to an IP provider")
+    parser.add_argument("--read-timeout", action=EnvDefault, envvar="READ_TIMEOUT", type=float,
+                        required=False, default=5, help="Seconds to wait for an IP provider to answer")
     parser.add_argument("-z", "--zone-id", action=EnvDefault,
-                        envvar='ZONE_ID', required=True, help="R53 Zone ID to Update")
-    parser.add_argument("-d", "--fqdn", action=EnvDefault, envvar='FQDN', required=True,
+                        envvar='ZONE_ID', required=False, help="R53 Zone ID to Update")
+    parser.add_argument("-d", "--fqdn", action=EnvDefault, envvar='FQDN', required=False,
                         help="FQDN to Update in the Zone, i.e. \"example.com.\" \
                                (note the trailing \".\")")
+    parser.add_argument("-T", "--ttl", action=EnvDefault, envvar="TTL", type=int,
+                        required=False, default=DEFAULT_TTL,
+                        help="TTL of the record given by --zone-id/--fqdn")
+    parser.add_argument("-t", "--record-type", action=EnvDefault, envvar="RECORD_TYPE", required=False,
+                        default="A", help="Type of the record given by --zone-id/--fqdn, A, AAAA \
+                                           or A,AAAA to update both")
+    parser.add_argument("-c", "--config", action=EnvDefault, envvar="CONFIG", required=False,
+                        help="JSON, TOML or YAML file listing the records to update, \
+                              instead of --zone-id/--fqdn")
+    parser.add_argument("-R", "--reconcile", action=EnvDefault, envvar="RECONCILE", required=False,
+                        help="Desired state file (JSON, TOML or YAML) of a zone's records. Instead of \
+                              updating an IP, the zone is made to match it with the fewest UPSERTs \
+                              and DELETEs")
+    parser.add_argument("--dry-run", action=EnvFlag, envvar="DRY_RUN",
+                        help="With --reconcile, print the changes without committing them")
     parser.add_argument("-a", "--aws-access-key-id", action=EnvDefault,
-                        envvar='AWS_ACCESS_KEY_ID', required=True, help="AWS Access Key ID")
+                        envvar='AWS_ACCESS_KEY_ID', required=False, help="AWS Access Key ID")
     parser.add_argument("-s", "--aws-secret-access-key", action=EnvDefault,
-                        envvar='AWS_SECRET_ACCESS_KEY', required=True, help="AWS Secret Access Key")
+                        envvar='AWS_SECRET_ACCESS_KEY', required=False, help="AWS Secret Access Key")
+    parser.add_argument("-f", "--state-file", action=EnvDefault, envvar="STATE_FILE", required=False,
+                        help="File remembering the last value committed or seen for each record, \
+                              so unchanged IPs don't need a Route53 read")
+    parser.add_argument("--state-max-age", action=EnvDefault, envvar="STATE_MAX_AGE", type=float,
+                        required=False, default=3600,
+                        help="Seconds a remembered value is trusted before Route53 is read again")
+    parser.add_argument("--verify", action=EnvDefault, envvar="VERIFY", required=False,
+                        default="api", choices=["api", "dns"],
+                        help="Read the current record through the Route53 API, or by asking the \
+                              zone's authoritative nameservers directly, which is faster and \
+                              doesn't count against the API rate limit (falls back to the API)")
+    parser.add_argument("--dns-timeout", action=EnvDefault, envvar="DNS_TIMEOUT", type=float,
+                        required=False, default=2, help="Seconds to wait for a DNS answer")
+    parser.add_argument("--stable-checks", action=EnvDefault, envvar="STABLE_CHECKS", type=int,
+                        required=False, default=1,
+                        help="Checks in a row a new IP must be seen in before it is committed")
+    parser.add_argument("--stable-seconds", action=EnvDefault, envvar="STABLE_SECONDS", type=float,
+                        required=False, default=0,
+                        help="Seconds a new IP must have been seen for before it is committed")
+    parser.add_argument("--r53-endpoint", action=EnvDefault, envvar="R53_ENDPOINT", required=False,
+                        default=R53_ENDPOINT, help="Route53 API endpoint, for testing against a stand-in")
+    parser.add_argument("--r53-rate", action=EnvDefault, envvar="R53_RATE", type=float,
+                        required=False, default=5,
+                        help="Route53 API calls per second, Route53 allows 5 per account")
+    parser.add_argument("--r53-rate-file", action=EnvDefault, envvar="R53_RATE_FILE", required=False,
+                        help="File used to share the --r53-rate budget between every ddns.py \
+                              process on the host that points at it")
+    parser.add_argument("--r53-concurrency", action=EnvDefault, envvar="R53_CONCURRENCY", type=int,
+                        required=False, default=4,
+                        help="Route53 calls in flight at once per AWS account")
+    parser.add_argument("--r53-retries", action=EnvDefault, envvar="R53_RETRIES", type=int,
+                        required=False, default=5,
+                        help="Retries of a Route53 call that was throttled or failed transiently")
+    parser.add_argument("-w", "--wait", action=EnvFlag, envvar="WAIT",
+                        help="Wait for updates to be INSYNC on all Route53 nameservers and report \
+                              how long that took")
+    parser.add_argument("--wait-timeout", action=EnvDefault, envvar="WAIT_TIMEOUT", type=float,
+                        required=False, default=300, help="Seconds to wait for an update to be INSYNC")
+    parser.add_argument("-D", "--daemon", action=EnvFlag, envvar="DAEMON",
+                        help="Keep running and check every --interval seconds")
+    parser.add_argument("-N", "--netlink", action=EnvFlag, envvar="NETLINK",
+                        help="Linux only, implies --daemon. Also check as soon as the kernel reports \
+                              a global interface address being added or removed")
+    parser.add_argument("-i", "--interval", action=EnvDefault, envvar="INTERVAL", type=float,
+                        required=False, default=60, help="Seconds between checks in daemon mode")
+    parser.add_argument("-j", "--jitter", action=EnvDefault, envvar="JITTER", type=float,
+                        required=False, default=5,
+                        help="Up to this many random seconds are added to each sleep in daemon \
+                              mode so many hosts don't hit the APIs in lockstep")
+    parser.add_argument("--stats", action=EnvFlag, envvar="STATS",
+                        help="Print IP lookup, connection pool and Route53 call statistics after \
+                              every check")
+    parser.add_argument("--log-format", action=EnvDefault, envvar="LOG_FORMAT", required=False,
+                        default="text", choices=["text", "json"],
+                        help="json replaces the per record lines with one JSON line per check, with \
+                              the duration of each phase and the HTTP connections opened")
+    parser.add_argument("--profile", action=EnvDefault, envvar="PROFILE", required=False,
+                        help="Directory to write cProfile .pstats files and text reports to, for \
+                              the whole run or every --profile-every checks in daemon mode")
+    parser.add_argument("--profile-memory", action=EnvFlag, envvar="PROFILE_MEMORY",
+                        help="With --profile, also trace allocations and report the top sites")
+    parser.add_argument("--profile-every", action=EnvDefault, envvar="PROFILE_EVERY", type=int,
+                        required=False, default=10, help="Daemon mode, profile one check in this many")
+    parser.add_argument("--metrics-port", action=EnvDefault, envvar="METRICS_PORT", type=int, required=False,
+                        help="Daemon mode, serve Prometheus metrics on this port at /metrics")
+    parser.add_argument("--metrics-address", action=EnvDefault, envvar="METRICS_ADDRESS", required=False,
+                        default="0.0.0.0", help="Address the --metrics-port listener binds to")
+
+    args = parser.parse_args(argv)
+    if not args.reconcile and not args.config and not (args.zone_id and args.fqdn):
+        parser.error("either --config or both --zone-id and --fqdn are required")
+    if args.reconcile and (args.daemon or args.netlink):
+        parser.error("--reconcile runs once, it can't be combined with --daemon")
+    args.record_type = [t.upper() for t in split_list(args.record_type)]
+    if not args.record_type or not set(args.record_type) <= set(RECORD_TYPES):
+        parser.error("--record-type must be A, AAAA or A,AAAA")
+    if args.netlink:
+        if not hasattr(socket, "AF_NETLINK"):
+            parser.error("--netlink is only available on Linux")
+        args.daemon = True
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    if args.jitter < 0:
+        parser.error("--jitter must not be negative")
+    if args.stable_checks < 1 or args.stable_seconds < 0:
+        parser.error("--stable-checks must be at least 1 and --stable-seconds not negative")
+    if (args.stable_checks > 1 or args.stable_seconds) and not (args.daemon or args.state_file):
+        parser.error("--stable-checks and --stable-seconds need --daemon or --state-file")
+    if args.r53_rate <= 0:
+        parser.error("--r53-rate must be positive")
+    if args.r53_concurrency < 1:
+        parser.error("--r53-concurrency must be at least 1")
+    if args.r53_retries < 0:
+        parser.error("--r53-retries must not be negative")
+    if args.hedge_delay < 0:
+        parser.error("--hedge-delay must not be negative")
+    if args.quorum < 1:
+        parser.error("--quorum must be at least 1")
+    if args.profile_every < 1:
+        parser.error("--profile-every must be at least 1")
+    if args.metrics_port is not None and not args.daemon:
+        parser.error("--metrics-port needs --daemon")
+    return args
+
+
+# Bad options or config files. Raised rather than exiting so an embedding process can handle it,
+# main() turns it into an error exit.
+class ConfigError(Exception):
+    pass
+
+
+def load_config(path):
+    # JSONDecodeError, TOMLDecodeError and UnicodeDecodeError are all ValueErrors
+    errors = (OSError, ValueError)
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ConfigError("YAML config files need PyYAML (pip install pyyaml)")
+        errors += (yaml.YAMLError,)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        if ext == ".toml":
+            import tomllib
+            config = tomllib.loads(data.decode())
+        elif ext in (".yaml", ".yml"):
+            config = yaml.safe_load(data)
+        else:
+            config = json.loads(data)
+    except errors as e:
+        raise ConfigError(f"{path}: {e}")
+    if not isinstance(config, dict):
+        raise ConfigError(f"{path}: expected a mapping at the top level")
+    return config
+
+
+def normalize_fqdn(fqdn):
+    fqdn = fqdn.strip().lower()
+    return fqdn if fqdn.endswith(".") else fqdn + "."
+
+
+def listed_fqdn(name):
+    # A name as ListResourceRecordSets returns it, in the form of normalize_fqdn. Route53 lists
+    # a wildcard's * escaped.
+    return name.replace("\\052", "*").lower()
+
+
+def load_records(args, config=None):
+    if config is None:
+        return [Record(args.zone_id, normalize_fqdn(args.fqdn), record_type, args.ttl)
+                for record_type in args.record_type]
+
+    # {"ttl": 60, "records": [{"zone_id": "Z...", "fqdn": "home.example.com.", "type": "A"}, ...]}
+    default_ttl = int(config.get("ttl", args.ttl))
+    records = []
+    seen = set()
+    for entry in config.get("records", []):
+        # "type" is a single type or a list, ["A", "AAAA"] for a dual-stack name
+        types = entry.get("type", "A")
+        for record_type in [types] if isinstance(types, str) else types:
+            try:
+                record = Record(entry["zone_id"], normalize_fqdn(entry["fqdn"]),
+                                record_type.upper(), int(entry.get("ttl", default_ttl)), entry.get("account"))
+            except KeyError as e:
+                raise ConfigError(f"{args.config}: record {entry!r} is missing {e}")
+            if record.type not in RECORD_TYPES:
+                raise ConfigError(f"{args.config}: unsupported record type {record.type} for {record.fqdn}")
+            if record.account is not None and record.account not in config.get("accounts", {}):
+                raise ConfigError(f"{args.config}: {record.fqdn} uses undefined account {record.account}")
+            # Both UPSERTs would go in the same batch, which Route53 rejects whole
+            if record[:3] in seen:
+                raise ConfigError(f"{args.config}: {record.fqdn} {record.type} is listed twice in {record.zone_id}")
+            seen.add(record[:3])
+            records.append(record)
+    if not records:
+        raise ConfigError(f"{args.config}: no records configured")
+    return records
+
+
+def load_accounts(args, records, config=None):
+    # {"accounts": {"prod": {"aws_access_key_id": "...", "aws_secret_access_key": "..."}}}
+    accounts = {}
+    for name in sorted({record.account for record in records}, key=str):
+        if name is None:
+            if not (args.aws_access_key_id and args.aws_secret_access_key):
+                raise ConfigError("--aws-access-key-id and --aws-secret-access-key are required")
+            accounts[None] = (args.aws_access_key_id, args.aws_secret_access_key)
+            continue
+        try:
+            account = config["accounts"][name]
+            accounts[name] = (account["aws_access_key_id"], account["aws_secret_access_key"])
+        except KeyError as e:
+            raise ConfigError(f"{args.config}: account {name} is missing {e}")
+    return accounts
+
+
+def load_desired(args):
+    # {"zone_id": "Z...", "ttl": 300, "records": [{"fqdn": "www.example.com.", "type": "A",
+    #                                               "values": ["192.0.2.1"]}, ...]}
+    config = load_config(args.reconcile)
+    zone_id = config.get("zone_id") or args.zone_id
+    if not zone_id:
+        raise ConfigError(f"{args.reconcile}: no zone_id, set it in the file or with --zone-id")
+    # No --ttl fallback, its default of 10 suits a dynamic address but would rewrite every other
+    # record of the zone
+    default_ttl = config.get("ttl")
+    desired = {}
+    for entry in config.get("records", []):
+        try:
+            values = entry["values"]
+            ttl = entry.get("ttl", default_ttl)
+            if ttl is None:
+                raise ConfigError(f"{args.reconcile}: record {entry!r} has no ttl, give it one or set one for the file")
+            rrset = RRSet(normalize_fqdn(entry["fqdn"]), entry["type"].upper(), int(ttl),
+                          [values] if isinstance(values, str) else [str(value) for value in values])
+        except KeyError as e:
+            raise ConfigError(f"{args.reconcile}: record {entry!r} is missing {e}")
+        if rrset.type == "SOA":
+            raise ConfigError(f"{args.reconcile}: the SOA record is managed by Route53")
+        if (rrset.name, rrset.type) in desired:
+            raise ConfigError(f"{args.reconcile}: {rrset.name} {rrset.type} is listed twice, list its values together")
+        desired[(rrset.name, rrset.type)] = rrset
+    if not desired:
+        # An empty file would delete the whole zone, much more likely a mistake
+        raise ConfigError(f"{args.reconcile}: no records configured")
+    return zone_id, desired
+
+
+class IPLookupError(Exception):
+    pass
+
+
+class IPDiscovery:
+    def __init__(self, session, urls, version=4, timeout=None, strategy="race", hedge_delay=0.5,
+                 quorum=2):
+        self.session = session
+        self.urls = urls
+        self.version = version
+        self.timeout = timeout
+        # UDP sources have no connect phase, they get the read timeout
+        self.udp_timeout = (timeout[-1] if isinstance(timeout, tuple) else timeout) or 5
+        self.strategy = strategy
+        self.initial_hedge_delay = hedge_delay
+        self.latencies = {url: deque(maxlen=LATENCY_WINDOW) for url in urls}
+        self.ewma = {}
+        self.quorum = quorum
+        self.counters = {"lookups": 0, "hedges": 0, "hedge_wins": 0, "disagreements": 0}
+        self.lock = threading.Lock()
+        self.metrics = None
+
+    def fetch(self, url):
+        start = time.monotonic()
+        try:
+            ip = self._query(url)
+        except Exception:
+            self._observe(url, None)
+            if self.metrics is not None:
+                self.metrics.inc("ddns_provider_errors_total", provider=url)
+            raise
+        latency = time.monotonic() - start
+        self._observe(url, latency)
+        if self.metrics is not None:
+            self.metrics.observe("ddns_provider_latency_seconds", latency, provider=url)
+        return ip
+
+    def _query(self, url):
+        parts = urlsplit(url)
+        if parts.scheme == "iface":
+            ip = self._check_public(url, interface_address(parts.netloc, self.version))
+        elif parts.scheme == "route":
+            ip = self._check_public(url, route_source_address(parts.hostname or ROUTE_DESTINATIONS[self.version],
+                                                              self.version))
+        elif parts.scheme == "stun":
+            ip = ipaddress.ip_address(stun_query(parts.hostname, parts.port or STUN_DEFAULT_PORT,
+                                                 self.version, self.udp_timeout))
+        elif parts.scheme == "dns":
+            ip = ipaddress.ip_address(dns_ip_query(parts.hostname, parts.port or 53, parts.path.lstrip("/"),
+                                                   parse_qs(parts.query).get("type", [None])[0],
+                                                   self.version, self.udp_timeout))
+        else:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            # Rejects error pages and captive portals before they end up in DNS
+            ip = ipaddress.ip_address(response.text.strip())
+        if ip.version != self.version:
+            raise IPLookupError(f"{url} answered {ip}, expected an IPv{self.version} address")
+        return str(ip)
+
+    def _observe(self, url, latency):
+        # latency is None for a failure
+        with self.lock:
+            if latency is not None:
+                self.latencies[url].append(latency)
+            entry = self.ewma.get(url)
+            if entry is None:
+                entry = self.ewma[url] = {"latency": latency or 0.0, "failure": 0.0 if latency is not None else 1.0}
+            else:
+                if latency is not None:
+                    entry["latency"] += EWMA_ALPHA * (latency - entry["latency"])
+                entry["failure"] += EWMA_ALPHA * ((latency is None) - entry["failure"])
+            entry["updated"] = time.time()
+
+    def lookup(self):
+        self._count("lookups")
+        if self.strategy == "quorum":
+            return self.agreed(self.urls, self.quorum)
+        if len(self.urls) == 1:
+            return self.fetch(self.urls[0])
+        if self.strategy == "hedge":
+            return self.hedged(self.urls)
+        if self.strategy == "ranked":
+            return self.ranked()
+        return self.race(self.urls)
+
+    def race(self, urls):
+        # Daemon threads so that a provider that is still pending once we have an answer is
+        # simply abandoned, it neither delays the answer nor the exit of a one-shot run
+        results = queue.Queue()
+        for url in urls:
+            self._start(url, results)
+
+        errors = []
+        for _ in urls:
+            url, ip, error = results.get()
+            if error is None:
+                return ip
+            errors.append(f"{url}: {error}")
+        raise IPLookupError("all IP providers failed: " + "; ".join(errors))
+
+    def hedged(self, urls):
+        # Providers are started in order, the next one when everything started so far has
+        # failed or the hedge delay has passed without an answer
+        results = queue.Queue()
+        delay = self.hedge_delay()
+        errors = []
+        started = 0
+        next_start = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if started < len(urls) and (now >= next_start or len(errors) == started):
+                self._start(urls[started], results)
+                if started:
+                    self._count("hedges")
+                started += 1
+                next_start = now + delay
+            elif len(errors) == len(urls):
+                raise IPLookupError("all IP providers failed: " + "; ".join(errors))
+
+            timeout = max(0, next_start - time.monotonic()) if started < len(urls) else None
+            try:
+                url, ip, error = results.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            if error is None:
+                if url != urls[0]:
+                    self._count("hedge_wins")
+                return ip
+            errors.append(f"{url}: {error}")
+
+    def agreed(self, urls, quorum):
+        # All providers at once, done as soon as quorum of them return the same address, so the
+        # wait is for the quorum-th fastest provider and not the slowest
+        results = queue.Queue()
+        for url in urls:
+            self._start(url, results)
+
+        votes = {}
+        errors = []
+        for answered in range(1, len(urls) + 1):
+            url, ip, error = results.get()
+            if error is None:
+                votes.setdefault(ip, []).append(url)
+                if len(votes) == 2 and len(votes[ip]) == 1:
+                    self._count("disagreements")
+                if len(votes[ip]) >= quorum:
+                    return ip
+            else:
+                errors.append(f"{url}: {error}")
+            if max(map(len, votes.values()), default=0) + len(urls) - answered < quorum:
+                break
+        answers = "; ".join(f"{ip} from {', '.join(voters)}" for ip, voters in votes.items())
+        raise IPLookupError(f"no {quorum} IP providers agree: " + "; ".join(filter(None, [answers] + errors)))
+
+    def ranked(self):
+        urls = self.ranked_urls()
+        with self.lock:
+            stalest = min(urls[1:], key=lambda url: self.ewma.get(url, {}).get("updated", 0))
+            probe = time.time() - self.ewma.get(stalest, {}).get("updated", 0) >= RANK_PROBE_AGE
+        if probe:
+            # A probe that answers before the best provider is in the figures a one-shot run
+            # saves, the ones that matter, as only those could take its place
+            self._start(stalest, queue.Queue())
+
+        errors = []
+        for url in urls:
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                errors.append(f"{url}: {e}")
+        raise IPLookupError("all IP providers failed: " + "; ".join(errors))
+
+    def expected_latency(self, url):
+        # Providers never tried rank first so they get measured
+        entry = self.ewma.get(url)
+        if entry is None:
+            return 0.0
+        return entry["latency"] + entry["failure"] * self.udp_timeout
+
+    def ranked_urls(self):
+        with self.lock:
+            return sorted(self.urls, key=self.expected_latency)
+
+    def load_ranking(self, ranking):
+        with self.lock:
+            self.ewma.update({url: dict(entry) for url, entry in ranking.items() if url in self.latencies})
+
+    def ranking(self):
+        with self.lock:
+            return {url: dict(entry) for url, entry in self.ewma.items()}
+
+    def hedge_delay(self):
+        with self.lock:
+            samples = sorted(self.latencies[self.urls[0]])
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return self.initial_hedge_delay
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    @staticmethod
+    def _check_public(url, address):
+        # Local sources happily return NATed or link local addresses, which never belong in public DNS
+        ip = ipaddress.ip_address(address)
+        if not ip.is_global:
+            raise IPLookupError(f"{url} has {ip}, which is not a public address")
+        return ip
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats["hedge_delay"] = round(self.hedge_delay(), 4)
+        stats["hedge_win_rate"] = round(stats["hedge_wins"] / stats["hedges"], 4) if stats["hedges"] else 0.0
+        stats["providers"] = {url: {"latency": round(entry["latency"], 4), "failure": round(entry["failure"], 4)}
+                              for url, entry in self.ranking().items()}
+        return stats
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _start(self, url, results):
+        threading.Thread(target=self._fetch_into, args=(url, results), daemon=True).start()
+
+    def _fetch_into(self, url, results):
+        try:
+            results.put((url, self.fetch(url), None))
+        except Exception as e:
+            results.put((url, None, e))
+
+
+class StateFile:
+    def __init__(self, path):
+        self.path = path
+        self.state = self._load()
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {"records": {}}
+        except ValueError as e:
+            # A corrupt cache only costs a Route53 read, never fail the run over it
+            print(f"WARNING: ignoring unreadable state file {self.path}: {e}\n", file=sys.stderr)
+            return {"records": {}}
+        state.setdefault("records", {})
+        return state
+
+    @staticmethod
+    def key(record):
+        return f"{record.zone_id}/{record.fqdn}/{record.type}"
+
+    def get(self, record, max_age):
+        entry = self.state["records"].get(self.key(record))
+        if entry is None or time.time() - entry["updated"] >= max_age:
+            return None
+        return entry["value"]
+
+    def set(self, record, value):
+        self.state["records"][self.key(record)] = {"value": value, "updated": time.time()}
+        self.dirty = True
+
+    def get_providers(self, version):
+        return self.state.get("providers", {}).get(f"ipv{version}", {})
+
+    def set_providers(self, version, ranking):
+        self.state.setdefault("providers", {})[f"ipv{version}"] = ranking
+        self.dirty = True
+
+    def get_nameservers(self, zone_id):
+        return self.state.get("nameservers", {}).get(zone_id)
+
+    def set_nameservers(self, zone_id, nameservers):
+        self.state.setdefault("nameservers", {})[zone_id] = nameservers
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        # Write-and-rename so a crash or a concurrent reader never sees a half written file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".ddns-state-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.state, f, indent=1, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FileTokenBucket(TokenBucket):
+    # The bucket lives in a small file under an exclusive lock, so every process on the host
+    # drawing from the same file shares one budget. Wall clock time since processes can't share
+    # a monotonic reference, a clock step backwards just refills nothing.
+
+    def __init__(self, path, rate, burst=None):
+        super().__init__(rate, burst)
+        self.path = path
+
+    def acquire(self):
+        import fcntl
+
+        while True:
+            with self.lock, open(self.path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                try:
+                    tokens, updated = (float(field) for field in f.read().split())
+                except ValueError:
+                    tokens, updated = self.capacity, time.time()
+                now = time.time()
+                tokens = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+                wait = 0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(f"{tokens} {now}\n")
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class Route53Error(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(f"{status} {code}: {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def connect_failed(error):
+    # Whether a request that raised error surely never reached Route53, as no connection could
+    # be opened. A read timeout or a dropped connection leaves it unknown.
+    requests = sys.modules.get("requests")
+    if requests is not None and isinstance(error, requests.exceptions.ConnectionError):
+        from urllib3.exceptions import ConnectTimeoutError
+
+        # ConnectTimeout, or a refused connection or failed name lookup (NewConnectionError)
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(error, requests.exceptions.ConnectTimeout) or isinstance(reason, ConnectTimeoutError)
+    return isinstance(error, (ConnectionRefusedError, socket.gaierror))
+
+
+def strip_id(resource_id, prefix):
+    # The API hands out ids as "/hostedzone/Z..." and "/change/C...", but takes them bare in URLs
+    return resource_id[len(prefix):] if resource_id.startswith(prefix) else resource_id
+
+
+class Route53Client:
+    # Just the four Route53 calls this script needs, signed with SigV4 by hand so that no
+    # AWS SDK has to be imported. Route53 is a global service, always signed for us-east-1.
+
+    def __init__(self, aws_access_key_id, aws_secret_access_key, endpoint=R53_ENDPOINT,
+                 timeout=(3.05, R53_READ_TIMEOUT), limiter=None, max_retries=5):
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.timeout = timeout
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.counters = {"calls": 0, "throttles": 0, "retries": 0}
+        # The same counters by (operation, counter), for --metrics-port
+        self.operations = {}
+        self.counters_lock = threading.Lock()
+        self.session = None
+
+    def list_rrsets(self, zone_id, name=None, record_type=None, identifier=None, maxitems=None):
+        # Returns one page of record sets starting at name/type, and the (name, type, identifier)
+        # to continue from, or None on the last page
+        params = {"name": name, "type": record_type, "identifier": identifier, "maxitems": maxitems}
+        root = self._request("ListResourceRecordSets", "GET", f"/hostedzone/{strip_id(zone_id, '/hostedzone/')}/rrset",
+                             {k: v for k, v in params.items() if v is not None})
+        rrsets = []
+        for element in root.iter(R53_XMLNS + "ResourceRecordSet"):
+            ttl = element.findtext(R53_XMLNS + "TTL")
+            rrsets.append(RRSet(element.findtext(R53_XMLNS + "Name"), element.findtext(R53_XMLNS + "Type"),
+                                int(ttl) if ttl is not None else None,
+                                [value.text for value in element.iter(R53_XMLNS + "Value")],
+                                element.findtext(R53_XMLNS + "SetIdentifier"),
+                                element.find(R53_XMLNS + "AliasTarget") is not None))
+        if root.findtext(R53_XMLNS + "IsTruncated") != "true":
+            return rrsets, None
+        return rrsets, (root.findtext(R53_XMLNS + "NextRecordName"), root.findtext(R53_XMLNS + "NextRecordType"),
+                        root.findtext(R53_XMLNS + "NextRecordIdentifier"))
+
+    def change_rrsets(self, zone_id, changes, comment=None):
+        # changes is a list of (action, RRSet), all applied atomically in one batch
+        body = encode_change_batch(changes, comment)
+        root = self._request("ChangeResourceRecordSets", "POST",
+                             f"/hostedzone/{strip_id(zone_id, '/hostedzone/')}/rrset", body=body)
+        return self._change_info(root)
+
+    def get_change(self, change_id):
+        return self._change_info(self._request("GetChange", "GET", f"/change/{strip_id(change_id, '/change/')}"))
+
+    def get_hosted_zone(self, zone_id):
+        root = self._request("GetHostedZone", "GET", f"/hostedzone/{strip_id(zone_id, '/hostedzone/')}")
+        zone = root.find(R53_XMLNS + "HostedZone")
+        return HostedZone(strip_id(zone.findtext(R53_XMLNS + "Id"), "/hostedzone/"), zone.findtext(R53_XMLNS + "Name"),
+                          [ns.text for ns in root.iter(R53_XMLNS + "NameServer")])
+
+    def _change_info(self, root):
+        info = root.find(R53_XMLNS + "ChangeInfo")
+        return ChangeInfo(strip_id(info.findtext(R53_XMLNS + "Id"), "/change/"), info.findtext(R53_XMLNS + "Status"))
+
+    def _request(self, operation, method, path, params=None, body=b""):
+        # Every attempt, retries included, draws from the rate limiter first
+        delay = R53_RETRY_BASE
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            self._count("calls", operation)
+            try:
+                return self._send(method, path, params, body)
+            except Route53Error as e:
+                if e.code in ("Throttling", "PriorRequestNotComplete"):
+                    self._count("throttles", operation)
+                if attempt == self.max_retries or not (e.code in R53_RETRY_CODES or e.status >= 500):
+                    raise
+                error = e
+            except OSError as e:
+                # Connection errors and timeouts, requests' exceptions are OSErrors too. A POST that
+                # may have been applied isn't sent again, a DELETE applied twice fails.
+                if attempt == self.max_retries or (method == "POST" and not connect_failed(e)):
+                    raise
+                error = e
+            # Decorrelated jitter: spreads out the retries of many hosts throttled at the same moment
+            delay = min(R53_RETRY_CAP, random.uniform(R53_RETRY_BASE, delay * 3))
+            self._count("retries", operation)
+            print(f"RETRY: {operation} {path} in {delay:.1f}s after {error} @ {datetime.now()}\n", file=sys.stderr)
+            time.sleep(delay)
+
+    def _count(self, counter, operation):
+        with self.counters_lock:
+            self.counters[counter] += 1
+            key = (operation, counter)
+            self.operations[key] = self.operations.get(key, 0) + 1
+
+    def _send(self, method, path, params=None, body=b""):
+        from xml.etree import ElementTree
+
+        if self.session is None:
+            import requests
+            self.session = requests.Session()
+
+        path = f"/{R53_API_VERSION}{path}"
+        query = "&".join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}"
+                         for k, v in sorted((params or {}).items()))
+        headers = self._sign(method, path, query, body)
+        if body:
+            headers["Content-Type"] = "application/xml"
+        url = self.endpoint + path + ("?" + query if query else "")
+        response = self.session.request(method, url, data=body or None, headers=headers, timeout=self.timeout)
+
+        try:
+            root = ElementTree.fromstring(response.content)
+        except ElementTree.ParseError:
+            root = None
+        if response.status_code >= 400 or root is None:
+            error = root.find(f".//{R53_XMLNS}Error") if root is not None else None
+            if error is None:
+                raise Route53Error(response.status_code, "HTTPError", response.text[:200])
+            raise Route53Error(response.status_code, error.findtext(R53_XMLNS + "Code"),
+                               error.findtext(R53_XMLNS + "Message"))
+        return root
+
+    def _sign(self, method, path, query, body):
+        import hashlib
+        import hmac
+
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now:%Y%m%d}/{R53_REGION}/{R53_SERVICE}/aws4_request"
+        payload_hash = hashlib.sha256(body).hexdigest()
+
+        canonical_request = "\n".join([method, quote(path, safe="/-_.~"), query,
+                                       f"host:{self.host}\nx-amz-date:{amz_date}\n",
+                                       "host;x-amz-date", payload_hash])
+        string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                                    hashlib.sha256(canonical_request.encode()).hexdigest()])
+
+        key = ("AWS4" + self.aws_secret_access_key).encode()
+        for part in scope.split("/"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        return {"X-Amz-Date": amz_date,
+                "Authorization": f"AWS4-HMAC-SHA256 Credential={self.aws_access_key_id}/{scope}, "
+                                 f"SignedHeaders=host;x-amz-date, Signature={signature}"}
+
+
+def encode_change_batch(changes, comment=None):
+    from xml.etree import ElementTree
+
+    root = ElementTree.Element("ChangeResourceRecordSetsRequest", xmlns=R53_XMLNS[1:-1])
+    batch = ElementTree.SubElement(root, "ChangeBatch")
+    if comment:
+        ElementTree.SubElement(batch, "Comment").text = comment
+    changes_element = ElementTree.SubElement(batch, "Changes")
+    for action, rrset in changes:
+        change = ElementTree.SubElement(changes_element, "Change")
+        ElementTree.SubElement(change, "Action").text = action
+        element = ElementTree.SubElement(change, "ResourceRecordSet")
+        ElementTree.SubElement(element, "Name").text = rrset.name
+        ElementTree.SubElement(element, "Type").text = rrset.type
+        if rrset.set_identifier:
+            ElementTree.SubElement(element, "SetIdentifier").text = rrset.set_identifier
+        ElementTree.SubElement(element, "TTL").text = str(rrset.ttl)
+        values = ElementTree.SubElement(element, "ResourceRecords")
+        for value in rrset.values:
+            ElementTree.SubElement(ElementTree.SubElement(values, "ResourceRecord"), "Value").text = value
+    return ElementTree.tostring(root, encoding="utf-8", xml_declaration=True)
+
+
+def chunk_changes(changes):
+    # Splits (action, RRSet) changes into batches within R53_MAX_*, keeping their order
+    return chunk_groups([change] for change in changes)
+
+
+def chunk_groups(groups):
+    # Same for lists of changes that must be applied together, a group is never split across
+    # batches. A group too big on its own still gets a batch, for Route53 to reject.
+    batch = []
+    values = characters = 0
+    for group in groups:
+        group_values = group_characters = 0
+        for action, rrset in group:
+            weight = 2 if action == "UPSERT" else 1
+            group_values += len(rrset.values) * weight
+            group_characters += sum(map(len, rrset.values)) * weight
+        if batch and (len(batch) + len(group) > R53_MAX_CHANGES or values + group_values > R53_MAX_VALUES
+                      or characters + group_characters > R53_MAX_VALUE_CHARACTERS):
+            yield batch
+            batch = []
+            values = characters = 0
+        batch += group
+        values += group_values
+        characters += group_characters
+    if batch:
+        yield batch
+
+
+def iter_rrsets(conn, zone_id):
+    # Every record set of the zone, a page at a time, so the zone is never held in memory whole
+    start = (None, None, None)
+    while True:
+        rrsets, start = conn.list_rrsets(zone_id, *start)
+        yield from rrsets
+        if start is None:
+            return
+
+
+class DNSError(Exception):
+    pass
+
+
+def encode_dns_name(name):
+    encoded = b""
+    for label in name.rstrip(".").split("."):
+        raw = label.encode("ascii")
+        if not raw or len(raw) > 63:
+            raise ValueError(f"invalid DNS name {name!r}")
+        encoded += bytes([len(raw)]) + raw
+    return encoded + b"\0"
+
+
+def encode_dns_query(name, qtype, txid, recursion_desired=False):
+    flags = 0x0100 if recursion_desired else 0
+    header = struct.pack("!HHHHHH", txid, flags, 1, 0, 0, 0)
+    return header + encode_dns_name(name) + struct.pack("!HH", qtype, 1)
+
+
+def decode_dns_name(data, offset):
+    # Returns the name and the offset just past it, following compression pointers
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise ValueError("DNS name compression loop")
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("ascii", "replace").lower())
+        offset += length
+    return ".".join(labels) + ".", end if end is not None else offset
+
+
+def decode_dns_response(data):
+    txid, flags, qdcount, ancount, _, _ = struct.unpack_from("!HHHHHH", data)
+    if not flags & 0x8000:
+        raise ValueError("not a DNS response")
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = decode_dns_name(data, offset)
+        offset += 4
+
+    answers = []
+    for _ in range(ancount):
+        name, offset = decode_dns_name(data, offset)
+        rtype, _, ttl, rdlength = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        rdata = data[offset:offset + rdlength]
+        if len(rdata) != rdlength:
+            raise ValueError("truncated DNS answer")
+        if rtype == DNS_TYPES["A"]:
+            value = str(ipaddress.IPv4Address(rdata))
+        elif rtype == DNS_TYPES["AAAA"]:
+            value = str(ipaddress.IPv6Address(rdata))
+        elif rtype in (DNS_TYPES["NS"], DNS_TYPES["CNAME"]):
+            value = decode_dns_name(data, offset)[0]
+        elif rtype == DNS_TYPES["TXT"]:
+            strings = []
+            position = 0
+            while position < len(rdata):
+                length = rdata[position]
+                strings.append(rdata[position + 1:position + 1 + length].decode("utf-8", "replace"))
+                position += 1 + length
+            value = "".join(strings)
+        else:
+            value = rdata
+        answers.append(DNSAnswer(name, rtype, ttl, value))
+        offset += rdlength
+
+    return DNSResponse(txid, bool(flags & 0x0400), bool(flags & 0x0200), flags & 0x000F, answers)
+
+
+def dns_query(server, name, qtype, timeout, port=53, recursion_desired=False):
+    txid = struct.unpack("!H", os.urandom(2))[0]
+    query = encode_dns_query(name, qtype, txid, recursion_desired)
+    family = socket.AF_INET6 if ":" in server else socket.AF_INET
+    deadline = time.monotonic() + timeout
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        # A connected UDP socket only accepts datagrams from the server we asked
+        sock.connect((server, port))
+        sock.send(query)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout(f"no DNS answer from {server}")
+            sock.settimeout(remaining)
+            data = sock.recv(4096)
+            try:
+                response = decode_dns_response(data)
+            except (ValueError, IndexError, struct.error):
+                continue
+            if response.id == txid:
+                return response
+
+
+class AuthoritativeResolver:
+    # Reads records straight from the zone's Route53 nameservers, the nameserver names come
+    # from a single GetHostedZone call and are remembered in the state file when there is one
+
+    def __init__(self, conn, state=None, timeout=2, port=53):
+        self.conn = conn
+        self.state = state
+        self.timeout = timeout
+        self.port = port
+        self.nameservers = {}
+        self.addresses = {}
+
+    def get_nameservers(self, zone_id):
+        if zone_id not in self.nameservers:
+            nameservers = self.state.get_nameservers(zone_id) if self.state is not None else None
+            if not nameservers:
+                nameservers = self.conn.get_hosted_zone(zone_id).nameservers
+                if self.state is not None:
+                    self.state.set_nameservers(zone_id, nameservers)
+            self.nameservers[zone_id] = nameservers
+        return self.nameservers[zone_id]
+
+    def resolve(self, nameserver):
+        if nameserver not in self.addresses:
+            self.addresses[nameserver] = socket.getaddrinfo(nameserver, self.port, type=socket.SOCK_DGRAM)[0][4][0]
+        return self.addresses[nameserver]
+
+    def get_current_value(self, record):
+        qtype = DNS_TYPES[record.type]
+        errors = []
+        for nameserver in self.get_nameservers(record.zone_id):
+            try:
+                response = dns_query(self.resolve(nameserver), record.fqdn, qtype, self.timeout, self.port)
+            except OSError as e:
+                errors.append(f"{nameserver}: {e}")
+                continue
+            if not response.authoritative or response.truncated \
+                    or response.rcode not in (DNS_NOERROR, DNS_NXDOMAIN):
+                errors.append(f"{nameserver}: unusable answer (rcode {response.rcode})")
+                continue
+            values = [answer.value for answer in response.answers
+                      if answer.type == qtype and answer.name == record.fqdn]
+            if not values:
+                return None
+            # Several values can never equal the single one we'd write, join them so they compare unequal
+            return values[0] if len(values) == 1 else ",".join(sorted(values))
+        raise DNSError(f"no authoritative answer for {record.fqdn}: " + "; ".join(errors))
+
+
+def interface_address(name, version):
+    if version == 4:
+        import fcntl
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack("256s", name.encode()[:15]))
+        return socket.inet_ntoa(ifreq[20:24])
+
+    # address, ifindex, prefix length, scope, flags, name
+    with open("/proc/net/if_inet6") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 6 and fields[5] == name and int(fields[3], 16) == 0 \
+                    and not int(fields[4], 16) & (IFA_F_TEMPORARY | IFA_F_DEPRECATED | IFA_F_TENTATIVE):
+                return str(ipaddress.IPv6Address(bytes.fromhex(fields[0])))
+    raise IPLookupError(f"{name} has no global IPv6 address")
+
+
+def route_source_address(destination, version):
+    family = socket.AF_INET if version == 4 else socket.AF_INET6
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        # Connecting a UDP socket sends nothing, the kernel just picks the route and source address
+        sock.connect((destination, 53))
+        return sock.getsockname()[0]
+
+
+def encode_stun_request(transaction):
+    return struct.pack("!HHI", STUN_BINDING_REQUEST, 0, STUN_MAGIC_COOKIE) + transaction
+
+
+def decode_stun_response(data, transaction):
+    # The reflexive address from a Binding Success Response to our transaction, None for anything
+    # else. XOR-MAPPED-ADDRESS wins over the plain MAPPED-ADDRESS that pre RFC 5389 servers send.
+    if len(data) < 20:
+        return None
+    msg_type, length, cookie = struct.unpack_from("!HHI", data)
+    if msg_type != STUN_BINDING_SUCCESS or cookie != STUN_MAGIC_COOKIE or data[8:20] != transaction:
+        return None
+
+    mapped = None
+    offset = 20
+    end = min(20 + length, len(data))
+    while offset + 4 <= end:
+        attr_type, attr_length = struct.unpack_from("!HH", data, offset)
+        value = data[offset + 4:offset + 4 + attr_length]
+        offset += 4 + ((attr_length + 3) & ~3)
+        if attr_type not in (STUN_MAPPED_ADDRESS, STUN_XOR_MAPPED_ADDRESS) or len(value) < 8:
+            continue
+        raw = value[4:8] if value[1] == 0x01 else value[4:20]
+        if attr_type == STUN_XOR_MAPPED_ADDRESS:
+            key = struct.pack("!I", STUN_MAGIC_COOKIE) + transaction
+            return str(ipaddress.ip_address(bytes(a ^ b for a, b in zip(raw, key))))
+        mapped = str(ipaddress.ip_address(raw))
+    return mapped
+
+
+def stun_query(host, port, version, timeout):
+    family = socket.AF_INET if version == 4 else socket.AF_INET6
+    address = socket.getaddrinfo(host, port, family, socket.SOCK_DGRAM)[0][4]
+    transaction = os.urandom(12)
+    request = encode_stun_request(transaction)
+    deadline = time.monotonic() + timeout
+    rto = STUN_INITIAL_RTO
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.connect(address)
+        while True:
+            sock.send(request)
+            resend_at = min(time.monotonic() + rto, deadline)
+            rto *= 2
+            while True:
+                remaining = resend_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data = sock.recv(2048)
+                except socket.timeout:
+                    break
+                ip = decode_stun_response(data, transaction)
+                if ip is not None:
+                    return ip
+            if time.monotonic() >= deadline:
+                raise socket.timeout(f"no STUN answer from {host}:{port}")
+
+
+def make_session(urls, version=None):
+    # Only HTTP providers need a session, and requests isn't even imported without one
+    if not any(urlsplit(url).scheme in HTTP_SCHEMES for url in urls):
+        return None
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class SourceAddressAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            if version is not None:
+                kwargs["source_address"] = SOURCE_ADDRESSES[version]
+            super().init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    # One pool per provider host so racing and hedging never evict each other's idle
+    # connections, and no adapter level retries since other providers are the retry
+    hosts = {urlsplit(url).netloc for url in urls if urlsplit(url).scheme in HTTP_SCHEMES}
+    adapter = SourceAddressAdapter(pool_connections=max(len(hosts), 1), pool_maxsize=POOL_MAXSIZE,
+                                   max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def pool_stats(session):
+    # urllib3 counts every connection it opens and every request it sends per host pool
+    connections = sent = 0
+    for adapter in set(session.adapters.values()) if session is not None else ():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:
+                continue
+            connections += pool.num_connections
+            sent += pool.num_requests
+    return {"http_requests": sent, "new_connections": connections,
+            "reused_connections": max(sent - connections, 0)}
+
+
+class ChangeWaiter:
+    # One poller for every outstanding change, however many records and zones they cover
+
+    def __init__(self, conn, timeout, log_format="text"):
+        self.conn = conn
+        self.timeout = timeout
+        self.log_format = log_format
+        self.changes = {}
+        # With --log-format json, how each change ended, until taken for the next JSON line
+        self.outcomes = []
+        self.condition = threading.Condition()
+        self.metrics = None
+
+    def add(self, change_id, description, conn=None):
+        now = time.monotonic()
+        with self.condition:
+            self.changes[change_id] = {"description": description, "conn": conn or self.conn, "submitted": now,
+                                       "deadline": now + self.timeout, "delay": WAIT_INITIAL_DELAY,
+                                       "next_poll": now + WAIT_INITIAL_DELAY}
+            self.condition.notify()
+
+    def poll(self):
+        # Checks every change that is due, returns the seconds until the next one is (None if none left)
+        now = time.monotonic()
+        with self.condition:
+            due = [(change_id, change) for change_id, change in self.changes.items()
+                   if change["next_poll"] <= now]
+
+        if not due:
+            statuses = []
+        elif len(due) == 1:
+            statuses = [self._status(*due[0])]
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=min(len(due), WAIT_MAX_CONCURRENCY)) as executor:
+                statuses = list(executor.map(lambda item: self._status(*item), due))
+
+        for (change_id, change), status in zip(due, statuses):
+            now = time.monotonic()
+            elapsed = now - change["submitted"]
+            if status == "INSYNC":
+                if self.log_format == "text":
+                    print(f"INSYNC: {change['description']} after {elapsed:.1f}s @ {datetime.now()}\n")
+                if self.metrics is not None:
+                    self.metrics.observe("ddns_check_phase_seconds", elapsed, phase="wait")
+            elif now >= change["deadline"]:
+                status = "TIMEOUT"
+                if self.log_format == "text":
+                    print(f"TIMEOUT: {change['description']} not INSYNC after {elapsed:.1f}s @ {datetime.now()}\n",
+                          file=sys.stderr)
+            else:
+                # Never sleep past the deadline, the last poll lands right on it
+                change["delay"] = min(change["delay"] * 2, WAIT_MAX_DELAY)
+                change["next_poll"] = min(now + change["delay"], change["deadline"])
+                continue
+            with self.condition:
+                del self.changes[change_id]
+                if self.log_format == "json":
+                    self.outcomes.append({"change_id": change_id, "description": change["description"],
+                                          "status": status, "seconds": round(elapsed, 3)})
+
+        with self.condition:
+            if not self.changes:
+                return None
+            return max(min(change["next_poll"] for change in self.changes.values()) - time.monotonic(), 0)
+
+    @staticmethod
+    def _status(change_id, change):
+        try:
+            return change["conn"].get_change(change_id).status
+        except Exception as e:
+            print(f"WARNING: GetChange {change_id} failed: {e} @ {datetime.now()}\n", file=sys.stderr)
+            return None
+
+    def take_outcomes(self):
+        with self.condition:
+            outcomes, self.outcomes = self.outcomes, []
+        return outcomes
+
+    def wait(self):
+        # Blocks until every change is INSYNC or has timed out
+        while True:
+            delay = self.poll()
+            if delay is None:
+                return
+            time.sleep(delay)
+
+    def start(self):
+        # Daemon mode, changes are polled in the background while checks go on
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.changes:
+                    self.condition.wait()
+                else:
+                    next_poll = min(change["next_poll"] for change in self.changes.values())
+                    self.condition.wait(timeout=max(next_poll - time.monotonic(), 0))
+            self.poll()
+
+
+class Stabilizer:
+    # A new IP has to be seen for a number of checks and seconds before it is committed. Kept in
+    # the state file when there is one, so it also works across one-shot runs.
+
+    def __init__(self, checks, seconds, state=None):
+        self.checks = checks
+        self.seconds = seconds
+        self.state = state
+        self.data = state.state.setdefault("stabilizer", {}) if state is not None else {}
+        self.data.setdefault("pending", {})
+        self.data.setdefault("flaps", 0)
+
+    def observe(self, key, value):
+        # True once value is stable enough to commit
+        now = time.time()
+        pending = self.data["pending"]
+        entry = pending.get(key)
+        if entry is None or entry["value"] != value:
+            if entry is not None:
+                # A -> B -> C, B never made it
+                self.data["flaps"] += 1
+            entry = pending[key] = {"value": value, "first_seen": now, "count": 0}
+        entry["count"] += 1
+        ready = entry["count"] >= self.checks and now - entry["first_seen"] >= self.seconds
+        if ready:
+            del pending[key]
+        self._changed()
+        return ready
+
+    def settle(self, key):
+        # The record already holds the IP we see, anything still pending was a flap A -> B -> A
+        if self.data["pending"].pop(key, None) is not None:
+            self.data["flaps"] += 1
+            self._changed()
+
+    def describe(self, key):
+        entry = self.data["pending"][key]
+        return f"seen {entry['count']}/{self.checks} checks over {time.time() - entry['first_seen']:.0f}s"
+
+    def flaps(self):
+        return self.data["flaps"]
+
+    def _changed(self):
+        if self.state is not None:
+            self.state.dirty = True
+
+
+class NetlinkWatcher:
+    # Listens for the kernel's interface address notifications, no traffic leaves the host
+
+    def __init__(self, settle=NETLINK_SETTLE):
+        self.settle = settle
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        self.sock.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+
+    def wait(self, timeout):
+        # True once a global address was added or removed, False if the timeout passed quietly
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self._receive(remaining):
+                # A DHCP renewal or an interface bounce arrives as a burst of messages, let it
+                # settle so the burst triggers one check
+                while self._receive(self.settle) is not None:
+                    pass
+                return True
+
+    def _receive(self, timeout):
+        # None on timeout, otherwise whether the messages read include an address change
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if not ready:
+            return None
+        try:
+            data = self.sock.recv(65536)
+        except OSError:
+            # ENOBUFS, the kernel dropped notifications we didn't read in time
+            return True
+        return self.address_changed(data)
+
+    @staticmethod
+    def address_changed(data):
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msg_type = struct.unpack_from("=LH", data, offset)
+            if length < 16:
+                break
+            if msg_type in (RTM_NEWADDR, RTM_DELADDR) and length >= 24:
+                # struct ifaddrmsg follows the header, link and host scoped addresses don't matter
+                scope = data[offset + 19]
+                if scope == RT_SCOPE_UNIVERSE:
+                    return True
+            offset += (length + 3) & ~3
+        return False
+
+
+class Metrics:
+    # Just enough of the Prometheus text format for the METRICS above, kept in plain dicts so
+    # recording a value is a lock, a dict lookup and for histograms a bisect. Values already
+    # counted elsewhere are copied in by the collectors only when scraped.
+
+    def __init__(self):
+        self.values = {name: {} for name in METRICS}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[name][key] = self.values[name].get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.values[name].get(key)
+            if histogram is None:
+                # Per bucket counts, +Inf last, then the sum
+                histogram = self.values[name][key] = [0] * (len(METRICS_BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(METRICS_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def render(self):
+        for collector in self.collectors:
+            collector(self)
+        lines = []
+        with self.lock:
+            for name, (kind, description) in METRICS.items():
+                lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+                for key, value in sorted(self.values[name].items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{self._labels(key)} {value}")
+                        continue
+                    count = 0
+                    for bound, bucket in zip(METRICS_BUCKETS + ("+Inf",), value):
+                        count += bucket
+                        lines.append(f"{name}_bucket{self._labels(key + (('le', str(bound)),))} {count}")
+                    lines += [f"{name}_sum{self._labels(key)} {value[-1]}", f"{name}_count{self._labels(key)} {count}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(key):
+        if not key:
+            return ""
+        pairs = []
+        for label, value in key:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{label}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+    def serve(self, address, port):
+        # GET /metrics on a background thread, scrapes never wait for a check
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class Profiler:
+    # Where cProfile only sees the thread that enabled it, every thread started while profiling
+    # (IP lookups, the Route53 calls of the check's executor) gets its own profile, merged
+    # into the report. tracemalloc covers the whole process anyway.
+
+    def __init__(self, directory, memory=False):
+        self.directory = directory
+        self.memory = memory
+        self.profile = None
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        import cProfile
+        import tracemalloc
+
+        self.thread_profiles = []
+        if PROFILE_PER_THREAD:
+            threading.setprofile(self._profile_thread)
+        if self.memory:
+            tracemalloc.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def _profile_thread(self, frame, event, arg):
+        # Runs once, on the new thread's first event, and hands over to a profile of its own
+        import cProfile
+
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def stop(self, name):
+        import pstats
+        import tracemalloc
+
+        self.profile.disable()
+        if PROFILE_PER_THREAD:
+            threading.setprofile(None)
+        snapshot = None
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        path = os.path.join(self.directory, f"ddns-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}-{name}")
+        with open(path + ".txt", "w") as f:
+            stats = pstats.Stats(self.profile, stream=f)
+            with self.lock:
+                for profile in self.thread_profiles:
+                    # A thread that never got to run its profile has nothing to add
+                    if profile.getstats():
+                        stats.add(profile)
+            stats.dump_stats(path + ".pstats")
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP)
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                               tracemalloc.Filter(False, "<frozen importlib._bootstrap>")])
+            with open(path + "-allocations.txt", "w") as f:
+                for statistic in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                    f.write(f"{statistic}\n")
+        print(f"PROFILE: wrote {path}.pstats @ {datetime.now()}\n", file=sys.stderr)
+
+
+def dns_ip_query(server, port, name, qtype, version, timeout):
+    # Servers like resolver1.opendns.com (myip.opendns.com) or ns1.google.com (TXT
+    # o-o.myaddr.l.google.com) answer with the address the query came from, so it has to go out
+    # over the family we're after
+    family = socket.AF_INET if version == 4 else socket.AF_INET6
+    address = socket.getaddrinfo(server, port, family, socket.SOCK_DGRAM)[0][4][0]
+    qtype = DNS_TYPES[(qtype or ("A" if version == 4 else "AAAA")).upper()]
+    name = normalize_fqdn(name)
+    response = dns_query(address, name, qtype, timeout, port=port, recursion_desired=True)
+    if response.rcode != DNS_NOERROR:
+        raise DNSError(f"{server} answered rcode {response.rcode} for {name}")
+    for answer in response.answers:
+        if answer.type != qtype:
+            continue
+        try:
+            return str(ipaddress.ip_address(answer.value))
+        except ValueError:
+            # Google also returns an edns0-client-subnet TXT record
+            continue
+    raise DNSError(f"{server} gave no address for {name}")
+
+
+def split_list(value):
+    return [item for item in value.replace(",", " ").split() if item]
+
+
+def make_client(args, aws_access_key_id, aws_secret_access_key, account=None):
+    # The rate limit is per account, so is the bucket
+    if args.r53_rate_file:
+        path = args.r53_rate_file if account is None else f"{args.r53_rate_file}.{account}"
+        limiter = FileTokenBucket(path, args.r53_rate)
+    else:
+        limiter = TokenBucket(args.r53_rate)
+    return Route53Client(aws_access_key_id, aws_secret_access_key, args.r53_endpoint,
+                         timeout=(args.connect_timeout, R53_READ_TIMEOUT), limiter=limiter,
+                         max_retries=args.r53_retries)
+
+
+def get_current_value(conn, record):
+    # maxitems=1 lists from the given name on, so the single result may be the next record
+    # in the zone if ours doesn't exist yet
+    rrsets, _ = conn.list_rrsets(record.zone_id, record.fqdn, record.type, maxitems=1)
+    if not rrsets:
+        return None
+    rrset = rrsets[0]
+    if listed_fqdn(rrset.name) != record.fqdn or rrset.type != record.type:
+        return None
+    return rrset_value(rrset)
+
+
+def rrset_value(rrset):
+    if not rrset.values:
+        return None
+    # AAAA values come back as they were written, compare them in canonical form
+    try:
+        return str(ipaddress.ip_address(rrset.values[0]))
+    except ValueError:
+        return rrset.values[0]
+
+
+def read_zone_values(conn, zone_id, records):
+    # The current value of each of records, all in zone_id, by (fqdn, type). Each page is listed
+    # from the first record not seen yet and matched against all of them, so records close
+    # together in the zone share a page while a large zone is never read whole. Like in
+    # get_current_value, a record that doesn't start its own page doesn't exist.
+    wanted = sorted({(record.fqdn, record.type) for record in records},
+                    key=lambda key: (tuple(reversed(key[0].rstrip(".").split("."))), key[1]))
+    values = {}
+    for key in wanted:
+        if key in values:
+            continue
+        rrsets, _ = conn.list_rrsets(zone_id, *key)
+        for rrset in rrsets:
+            values.setdefault((listed_fqdn(rrset.name), rrset.type), rrset_value(rrset))
+        values.setdefault(key, None)
+    return {key: values[key] for key in wanted}
+
+
+def read_current_value(conn, resolver, record):
+    if resolver is not None:
+        try:
+            return resolver.get_current_value(record)
+        except (OSError, DNSError) as e:
+            print(f"WARNING: DNS verification failed, using the Route53 API: {e} @ {datetime.now()}\n",
+                  file=sys.stderr)
+    return get_current_value(conn, record)
+
+
+def discover(discoveries):
+    # Each family is looked up once for all records, and both at the same time so a dual-stack
+    # check waits for the slower lookup rather than the sum. One family failing doesn't stop
+    # the other's records from being updated.
+    if len(discoveries) == 1:
+        # A single family needs no thread of its own
+        ((record_type, discovery),) = discoveries.items()
+        return {record_type: discovery.lookup()}
+
+    # asyncio and concurrent.futures (which imports logging) are only imported once needed,
+    # like requests, so that importing the script stays cheap
+    from concurrent.futures import ThreadPoolExecutor
+
+    ips = {}
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(discoveries)) as executor:
+        futures = {record_type: executor.submit(discovery.lookup)
+                   for record_type, discovery in discoveries.items()}
+        for record_type, future in futures.items():
+            try:
+                ips[record_type] = future.result()
+            except Exception as e:
+                errors.append(e)
+                print(f"WARNING: {record_type} address lookup failed: {e} @ {datetime.now()}\n", file=sys.stderr)
+    if not ips:
+        raise errors[0]
+    return ips
+
+
+class Updater:
+    # Everything a check needs, built once from parse_args() options and kept warm between
+    # checks, so a long running process can embed it instead of running the script:
+    #
+    #   updater = Updater(parse_args(["--config", "records.json", "--state-file", "state.json"]))
+    #   for result in updater.sync():
+    #       print(result.record.fqdn, result.status, result.new)
+
+    def __init__(self, args):
+        self.args = args
+        config = load_config(args.config) if args.config else None
+        self.records = load_records(args, config)
+        accounts = load_accounts(args, self.records, config)
+        self.state = StateFile(args.state_file) if args.state_file else None
+
+        # One session per family and one R53 client per account for the life of the updater, so
+        # checks reuse their TCP+TLS connections
+        provider_urls = {"A": split_list(args.ip_query_url), "AAAA": split_list(args.ipv6_query_url)}
+        self.discoveries = {}
+        for record_type in sorted({record.type for record in self.records}):
+            urls = provider_urls[record_type]
+            version = IP_VERSIONS[record_type]
+            if args.ip_strategy == "quorum" and args.quorum > len(urls):
+                raise ConfigError(f"--quorum {args.quorum} needs at least as many IPv{version} providers, "
+                                  f"got {len(urls)}")
+            discovery = IPDiscovery(make_session(urls, version), urls, version,
+                                    timeout=(args.connect_timeout, args.read_timeout),
+                                    strategy=args.ip_strategy, hedge_delay=args.hedge_delay, quorum=args.quorum)
+            if self.state is not None:
+                discovery.load_ranking(self.state.get_providers(version))
+            self.discoveries[record_type] = discovery
+
+        self.clients = {}
+        self.resolvers = {}
+        for account, (aws_access_key_id, aws_secret_access_key) in accounts.items():
+            self.clients[account] = make_client(args, aws_access_key_id, aws_secret_access_key, account)
+            if args.verify == "dns":
+                self.resolvers[account] = AuthoritativeResolver(self.clients[account], self.state, args.dns_timeout)
+
+        self.waiter = None
+        if args.wait:
+            self.waiter = ChangeWaiter(next(iter(self.clients.values())), args.wait_timeout, args.log_format)
+        self.stabilizer = None
+        if args.stable_checks > 1 or args.stable_seconds:
+            self.stabilizer = Stabilizer(args.stable_checks, args.stable_seconds, self.state)
+
+        # Threads for the blocking calls of checks, started by the first check and kept until
+        # close(). Never the running loop's default executor, which belongs to the embedding
+        # process when it awaits check_async()/sync_async().
+        self.executor = None
+
+        # Monotonic durations of the last check's phases
+        self.phases = {}
+        self.metrics = None
+        if args.metrics_port is not None:
+            self.metrics = Metrics()
+            self.metrics.collectors.append(self._collect_route53)
+            for discovery in self.discoveries.values():
+                discovery.metrics = self.metrics
+            if self.waiter is not None:
+                self.waiter.metrics = self.metrics
+
+    def check(self):
+        # What sync() would do, without committing anything
+        import asyncio
+
+        return asyncio.run(self.check_async())
+
+    def sync(self):
+        import asyncio
+
+        return asyncio.run(self.sync_async())
+
+    # The same for a process that already runs an event loop, where asyncio.run() can't be called
+    async def check_async(self):
+        return await self._run(commit=False)
+
+    async def sync_async(self):
+        return await self._run(commit=True)
+
+    def close(self):
+        # Stops the check threads, the next check starts new ones
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def wait(self):
+        # Blocks until the changes committed so far are INSYNC, with --wait
+        if self.waiter is not None:
+            self.waiter.wait()
+
+    def stats(self):
+        stats = {record_type: dict(discovery.stats(), **pool_stats(discovery.session))
+                 for record_type, discovery in self.discoveries.items()}
+        stats["route53"] = {}
+        for account, client in self.clients.items():
+            with client.counters_lock:
+                stats["route53"][account or "default"] = dict(client.counters)
+        if self.stabilizer is not None:
+            stats["flaps"] = self.stabilizer.flaps()
+        return stats
+
+    def connections(self):
+        # HTTP connections opened so far, to IP providers and Route53
+        sessions = [discovery.session for discovery in self.discoveries.values()]
+        sessions += [client.session for client in self.clients.values()]
+        return sum(pool_stats(session)["new_connections"] for session in sessions)
+
+    def _collect_route53(self, metrics):
+        for account, client in self.clients.items():
+            with client.counters_lock:
+                operations = dict(client.operations)
+            for (operation, counter), value in operations.items():
+                metrics.set(f"ddns_route53_{counter}_total", value, account=account or "default", operation=operation)
+
+    def _record_metrics(self, duration, phases, results):
+        metrics = self.metrics
+        metrics.observe("ddns_check_seconds", duration)
+        for phase, seconds in phases.items():
+            metrics.observe("ddns_check_phase_seconds", seconds, phase=phase)
+        now = time.time()
+        for result in results:
+            metrics.inc("ddns_records_total", status=result.status)
+            if result.status == "updated":
+                metrics.set("ddns_record_last_change_timestamp_seconds", now,
+                            fqdn=result.record.fqdn, type=result.record.type)
+
+    async def _run(self, commit):
+        # The blocking calls run on threads, bounded per AWS account by --r53-concurrency on top
+        # of each account's rate limiter, while the decisions and bookkeeping stay on the event loop
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        args, state = self.args, self.state
+        stabilizer = self.stabilizer if commit else None
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=max(len(self.clients) * args.r53_concurrency, 4))
+        executor = self.executor
+        limits = {account: asyncio.Semaphore(args.r53_concurrency) for account in self.clients}
+
+        async def call(account, function, *call_args):
+            async with limits[account]:
+                return await loop.run_in_executor(executor, function, *call_args)
+
+        # Monotonic durations of the phases that had anything to do
+        start = time.monotonic()
+        phases = self.phases = {}
+
+        # Get my IPs, once for all records
+        try:
+            ips = await loop.run_in_executor(executor, discover, self.discoveries)
+            phases["discover"] = time.monotonic() - start
+        finally:
+            if state is not None and args.ip_strategy == "ranked":
+                # One-shot runs only learn which providers are fast through the state file
+                for discovery in self.discoveries.values():
+                    state.set_providers(discovery.version, discovery.ranking())
+                state.save()
+
+        results = []
+        to_read = []
+        for record in self.records:
+            new_value = ips.get(record.type)
+            if new_value is None:
+                results.append(Result(record, "skipped"))
+            elif state is not None and state.get(record, args.state_max_age) == new_value:
+                if stabilizer is not None:
+                    stabilizer.settle(StateFile.key(record))
+                results.append(Result(record, "cached", new_value, new_value))
+            else:
+                to_read.append((record, new_value))
+
+        # Compare against R53, all reads in flight together, collecting the UPSERTs per zone.
+        # Records of a zone with enough of them to read (and no DNS verification) are read from
+        # its pages, the others one call each.
+        phase_start = time.monotonic()
+        zones = {}
+        for index, (record, _) in enumerate(to_read):
+            if record.account not in self.resolvers:
+                zones.setdefault((record.account, record.zone_id), []).append(index)
+        zones = {zone: indexes for zone, indexes in zones.items() if len(indexes) >= ZONE_READ_MIN_RECORDS}
+        zone_indexes = {index for indexes in zones.values() for index in indexes}
+        singles = [index for index in range(len(to_read)) if index not in zone_indexes]
+        outcomes = await asyncio.gather(
+            *(call(to_read[index][0].account, read_current_value, self.clients[to_read[index][0].account],
+                   self.resolvers.get(to_read[index][0].account), to_read[index][0]) for index in singles),
+            *(call(account, read_zone_values, self.clients[account], zone_id,
+                   [to_read[index][0] for index in indexes]) for (account, zone_id), indexes in zones.items()),
+            return_exceptions=True)
+        r53_values = [None] * len(to_read)
+        for index, value in zip(singles, outcomes):
+            r53_values[index] = value
+        for indexes, values in zip(zones.values(), outcomes[len(singles):]):
+            for index in indexes:
+                record = to_read[index][0]
+                r53_values[index] = values if isinstance(values, Exception) else values[(record.fqdn, record.type)]
+        if to_read:
+            phases["read"] = time.monotonic() - phase_start
+        pending = {}
+        for (record, new_value), r53_value in zip(to_read, r53_values):
+            key = StateFile.key(record)
+            if isinstance(r53_value, Exception):
+                results.append(Result(record, "error", new=new_value, error=r53_value))
+            elif new_value == r53_value:
+                if state is not None:
+                    state.set(record, r53_value)
+                if stabilizer is not None:
+                    stabilizer.settle(key)
+                results.append(Result(record, "unchanged", r53_value, new_value))
+            elif stabilizer is not None and not stabilizer.observe(key, new_value):
+                results.append(Result(record, "unstable", r53_value, new_value, detail=stabilizer.describe(key)))
+            elif not commit:
+                results.append(Result(record, "pending", r53_value, new_value))
+            else:
+                pending.setdefault((record.account, record.zone_id), []).append((record, r53_value, new_value))
+
+        # One change batch, and so one API call, per zone, every zone at once
+        async def commit_zone(account, zone_id, updates):
+            # As few batches as Route53's limits allow, one after the other
+            changes = [("UPSERT", RRSet(record.fqdn, record.type, record.ttl, [new_value]))
+                       for record, _, new_value in updates]
+            zone_results = []
+            for batch in chunk_changes(changes):
+                batch_updates, updates = updates[:len(batch)], updates[len(batch):]
+                try:
+                    change = await call(account, self.clients[account].change_rrsets, zone_id, batch)
+                except Exception as e:
+                    zone_results += [Result(record, "error", r53_value, new_value, error=e)
+                                     for record, r53_value, new_value in batch_updates]
+                    continue
+                if self.waiter is not None:
+                    self.waiter.add(change.id, ", ".join(f"{record.fqdn} {record.type}"
+                                                         for record, _, _ in batch_updates), self.clients[account])
+                if state is not None:
+                    for record, _, new_value in batch_updates:
+                        state.set(record, new_value)
+                zone_results += [Result(record, "updated", r53_value, new_value, change.id)
+                                 for record, r53_value, new_value in batch_updates]
+            return zone_results
+
+        phase_start = time.monotonic()
+        for zone_results in await asyncio.gather(*(commit_zone(account, zone_id, updates)
+                                                   for (account, zone_id), updates in pending.items())):
+            results.extend(zone_results)
+        if pending:
+            phases["commit"] = time.monotonic() - phase_start
+
+        if state is not None:
+            state.save()
+        if self.metrics is not None:
+            self._record_metrics(time.monotonic() - start, phases, results)
+
+        # In the order the records were configured
+        order = {record: position for position, record in enumerate(self.records)}
+        return sorted(results, key=lambda result: order[result.record])
+
+
+def print_result(result):
+    record = result.record
+    name = f"{record.fqdn} {record.type}"
+    if result.status == "skipped":
+        print(f"SKIPPED: {name}, no IPv{IP_VERSIONS[record.type]} address @ {datetime.now()}\n")
+    elif result.status == "cached":
+        print(f"NO UPDATE: {name} {result.new} (cached) @ {datetime.now()}\n")
+    elif result.status == "unchanged":
+        print(f"NO UPDATE: {name} {result.new} @ {datetime.now()}\n")
+    elif result.status == "unstable":
+        print(f"UNSTABLE: {name} {result.new} {result.detail} @ {datetime.now()}\n")
+    elif result.status == "updated":
+        print(f"UPDATED: {name} FROM {result.current} to {result.new} @ {datetime.now()}\n")
+    elif result.status == "error":
+        print(f"ERROR: {name}: {result.error!r} @ {datetime.now()}\n", file=sys.stderr)
+
+
+def log_json(results, duration, phases, connections, **fields):
+    # The single stdout line of a check with --log-format json, fields adds to it
+    records = []
+    for result in results:
+        entry = {"fqdn": result.record.fqdn, "type": result.record.type, "status": result.status}
+        for field in ("current", "new", "change_id", "detail"):
+            if getattr(result, field) is not None:
+                entry[field] = getattr(result, field)
+        if result.error is not None:
+            entry["error"] = repr(result.error)
+        records.append(entry)
+    print(json.dumps(dict({"time": datetime.now().isoformat(), "duration": round(duration, 6),
+                           "phases": {phase: round(seconds, 6) for phase, seconds in phases.items()},
+                           "http_connections": connections, "records": records}, **fields)))
+
+
+def run_once(args, updater, startup=None, trigger=None):
+    # startup has the phases before the first check, imports, args and setup, for its log line.
+    # trigger says what started a daemon check early.
+    start = time.monotonic()
+    connections = updater.connections()
+    results = updater.sync()
+    phases = dict(startup or {}, **updater.phases)
+    if not args.daemon and updater.waiter is not None:
+        wait_start = time.monotonic()
+        updater.wait()
+        phases["wait"] = time.monotonic() - wait_start
+
+    if args.log_format == "json":
+        # Everything about the check goes in its one line: the changes that became INSYNC (or
+        # timed out) since the last line, what triggered it and --stats
+        fields = {}
+        if updater.waiter is not None:
+            fields["changes"] = updater.waiter.take_outcomes()
+        if trigger is not None:
+            fields["trigger"] = trigger
+        if args.stats:
+            fields["stats"] = updater.stats()
+        log_json(results, time.monotonic() - start, phases, updater.connections() - connections, **fields)
+        return results
+
+    for result in results:
+        print_result(result)
+    if args.stats:
+        print(f"STATS: {json.dumps(updater.stats(), sort_keys=True)} @ {datetime.now()}\n")
+    return results
+
+
+def run_daemon(args, updater, watcher=None, startup=None, profiler=None):
+    # Scheduled off the monotonic clock so wall clock steps (NTP, DST) don't bunch or skip checks.
+    # Jitter is added to each sleep only, so it never accumulates into drift.
+    next_run = time.monotonic()
+    checks = 0
+    trigger = None
+    while True:
+        profiled = profiler is not None and checks % args.profile_every == 0
+        if profiled:
+            if PROFILE_PER_THREAD:
+                # Only threads started while profiling get a profile, so the check starts its own
+                updater.close()
+            profiler.start()
+        try:
+            run_once(args, updater, startup, trigger)
+        except Exception as e:
+            if args.log_format == "json":
+                print(json.dumps({"time": datetime.now().isoformat(), "error": repr(e)}), file=sys.stderr)
+            else:
+                print(f"ERROR: {e!r} @ {datetime.now()}\n", file=sys.stderr)
+        finally:
+            if profiled:
+                profiler.stop(f"check{checks}")
+        startup = trigger = None
+        checks += 1
+
+        next_run += args.interval
+        now = time.monotonic()
+        if next_run < now:
+            # A check overran the interval, skip the missed ticks instead of bursting
+            next_run = now
+        delay = next_run - now + random.uniform(0, args.jitter)
+        if watcher is None:
+            time.sleep(delay)
+        elif watcher.wait(delay):
+            # An address changed, check right away and count the interval from here
+            if args.log_format == "json":
+                trigger = "address_change"
+            else:
+                print(f"ADDRESS CHANGE: checking now @ {datetime.now()}\n")
+            next_run = time.monotonic()
+
+
+def diff_zone(rrsets, desired, apex):
+    # The changes that turn the streamed record sets into the desired ones, as one group per
+    # name so that a name's DELETEs (an A replaced by a CNAME) go in the same batch as its
+    # UPSERTs. Names with only UPSERTs come first, then those with both, then those with only
+    # DELETEs, so a failed batch leaves records missing their deletion rather than deleted
+    # records missing their replacement.
+    # SOA and the apex NS belong to Route53, and alias and routing policy (set identifier)
+    # records can't be described by the desired state, so they are all left alone.
+    remaining = dict(desired)
+    deletes, upserts = {}, {}
+    for rrset in rrsets:
+        if (rrset.alias or rrset.set_identifier or rrset.type == "SOA"
+                or (rrset.type == "NS" and rrset.name == apex)):
+            continue
+        name = listed_fqdn(rrset.name)
+        wanted = remaining.pop((name, rrset.type), None)
+        if wanted is None:
+            deletes.setdefault(name, []).append(("DELETE", rrset))
+        elif wanted.ttl != rrset.ttl or sorted(wanted.values) != sorted(rrset.values):
+            upserts.setdefault(name, []).append(("UPSERT", wanted))
+    for (name, _), rrset in remaining.items():
+        upserts.setdefault(name, []).append(("UPSERT", rrset))
+    return ([group for name, group in upserts.items() if name not in deletes]
+            + [deletes[name] + group for name, group in upserts.items() if name in deletes]
+            + [group for name, group in deletes.items() if name not in upserts])
+
+
+def run_reconcile(args):
+    start = time.monotonic()
+    zone_id, desired = load_desired(args)
+    if not (args.aws_access_key_id and args.aws_secret_access_key):
+        raise ConfigError("--aws-access-key-id and --aws-secret-access-key are required")
+    conn = make_client(args, args.aws_access_key_id, args.aws_secret_access_key)
+
+    apex = normalize_fqdn(conn.get_hosted_zone(zone_id).name)
+    if (apex, "NS") in desired:
+        raise ConfigError(f"{args.reconcile}: the NS record of {apex} is managed by Route53")
+    groups = diff_zone(iter_rrsets(conn, zone_id), desired, apex)
+    changes = [change for group in groups for change in group]
+    batches = list(chunk_groups(groups))
+
+    waiter = ChangeWaiter(conn, args.wait_timeout, args.log_format) if args.wait and not args.dry_run else None
+    change_ids = []
+    for batch in batches:
+        if args.log_format == "text":
+            for action, rrset in batch:
+                print(f"{'WOULD ' if args.dry_run else ''}{action}: {rrset.name} {rrset.type} {rrset.ttl} "
+                      f"{' '.join(rrset.values)} @ {datetime.now()}\n")
+        if args.dry_run:
+            continue
+        try:
+            change = conn.change_rrsets(zone_id, batch, f"r53-ddns reconcile of {os.path.basename(args.reconcile)}")
+        except Exception as e:
+            sys.exit(f"ERROR: reconciling {zone_id} failed after {len(change_ids)} of {len(batches)} batches: {e!r}")
+        change_ids.append(change.id)
+        if waiter is not None:
+            waiter.add(change.id, f"{zone_id} batch {len(change_ids)} of {len(batches)}")
+
+    if waiter is not None:
+        waiter.wait()
 
-    args = parser.parse_args()
-    # Get my IP
-    new_ip = requests.get(args.ip_query_url).text.strip()
+    upserts = sum(action == "UPSERT" for action, _ in changes)
+    deletes = len(changes) - upserts
+    if args.log_format == "json":
+        line = {"time": datetime.now().isoformat(), "duration": round(time.monotonic() - start, 6),
+                "zone_id": zone_id, "dry_run": args.dry_run, "upserts": upserts, "deletes": deletes,
+                "batches": len(batches), "change_ids": change_ids}
+        if waiter is not None:
+            line["changes"] = waiter.take_outcomes()
+        if args.dry_run:
+            # What text mode prints as WOULD lines, to review before running it for real
+            line["plan"] = [{"action": action, "name": rrset.name, "type": rrset.type, "ttl": rrset.ttl,
+                             "values": rrset.values} for action, rrset in changes]
+        print(json.dumps(line))
+    elif not changes:
+        print(f"NO UPDATE: {zone_id} matches {args.reconcile} @ {datetime.now()}\n")
+    else:
+        print(f"{'WOULD RECONCILE' if args.dry_run else 'RECONCILED'}: {zone_id} {upserts} UPSERTs and "
+              f"{deletes} DELETEs in {len(batches)} batches @ {datetime.now()}\n")
 
-    # Connect R53, Get IP from A Record
-    conn = Route53Connection(aws_access_key_id=args.aws_access_key_id,
-                             aws_secret_access_key=args.aws_secret_access_key)
-    r53_ip = conn.get_all_rrsets(args.zone_id, 'A', args.fqdn, maxitems=1)[
-        0].resource_records[0]
 
-    if new_ip == r53_ip:
-        print(f"NO UPDATE: {new_ip} @ {datetime.now()}\n")
-        sys.exit(0)
+def main(argv=None):
+    start = time.monotonic()
+    startup = {"imports": start - STARTED}
+    args = parse_args(argv)
+    startup["args"] = time.monotonic() - start
+    profiler = Profiler(args.profile, args.profile_memory) if args.profile else None
+    if profiler is not None and not args.daemon:
+        # One-shot runs are profiled whole from here on, setup included
+        profiler.start()
 
-    # Change needed, upsert the record
-    changes = ResourceRecordSets(conn, args.zone_id)
-    record = changes.add_change("UPSERT", args.fqdn, "A", 10)
-    record.add_value(new_ip)
+    updater = None
+    try:
+        if args.reconcile:
+            run_reconcile(args)
+            return
 
-    # commit
-    changes.commit()
+        # Updater imports requests when it makes the first session
+        start = time.monotonic()
+        updater = Updater(args)
+        startup["setup"] = time.monotonic() - start
 
-    print(f"UPDATED: FROM {r53_ip} to {new_ip} @ {datetime.now()}\n")
+        if args.daemon:
+            if updater.waiter is not None:
+                updater.waiter.start()
+            if updater.metrics is not None:
+                updater.metrics.serve(args.metrics_address, args.metrics_port)
+            watcher = NetlinkWatcher() if args.netlink else None
+            run_daemon(args, updater, watcher, startup, profiler)
+        else:
+            results = run_once(args, updater, startup)
+            if any(result.status == "error" for result in results):
+                sys.exit(1)
+    except ConfigError as e:
+        sys.exit(str(e))
+    finally:
+        if updater is not None:
+            updater.close()
+        if profiler is not None and not args.daemon:
+            profiler.stop("run")
 
 
 if __name__ == "__main__":
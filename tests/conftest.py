@@ -0,0 +1,72 @@
+import os
+import sys
+import socket
+import struct
+import threading
+import ipaddress
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import ddns  # noqa: E402
+
+
+class UDPStandIn:
+    # A UDP server on 127.0.0.1 standing in for a nameserver or a STUN server. handler gets each
+    # datagram and returns the datagrams to send back, none to drop it.
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.received = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            self.received.append(data)
+            for reply in self.handler(data) or ():
+                self.sock.sendto(reply, address)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def udp_stand_in():
+    servers = []
+
+    def start(handler):
+        server = UDPStandIn(handler)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def stun_address(attr_type, ip, transaction):
+    # A MAPPED-ADDRESS or XOR-MAPPED-ADDRESS attribute
+    ip = ipaddress.ip_address(ip)
+    raw = ip.packed
+    port = 40000
+    if attr_type == ddns.STUN_XOR_MAPPED_ADDRESS:
+        key = struct.pack("!I", ddns.STUN_MAGIC_COOKIE) + transaction
+        raw = bytes(a ^ b for a, b in zip(raw, key))
+        port ^= ddns.STUN_MAGIC_COOKIE >> 16
+    value = struct.pack("!BBH", 0, 0x01 if ip.version == 4 else 0x02, port) + raw
+    return struct.pack("!HH", attr_type, len(value)) + value
+
+
+def stun_response(transaction, *attributes, msg_type=ddns.STUN_BINDING_SUCCESS):
+    body = b"".join(attributes)
+    return struct.pack("!HHI", msg_type, len(body), ddns.STUN_MAGIC_COOKIE) + transaction + body
@@ -0,0 +1,127 @@
+import struct
+
+import pytest
+
+import ddns
+
+RECORD = ddns.Record("Z0123", "home.example.com.", "A", 10)
+
+
+def dns_response(query, answers=(), rcode=ddns.DNS_NOERROR, authoritative=True, txid=None):
+    # Echoes the question, every answer's name is a compression pointer to it
+    query_txid = struct.unpack_from("!H", query)[0]
+    flags = 0x8000 | (0x0400 if authoritative else 0) | rcode
+    data = struct.pack("!HHHHHH", query_txid if txid is None else txid, flags, 1, len(answers), 0, 0) + query[12:]
+    for rtype, rdata in answers:
+        data += b"\xc0\x0c" + struct.pack("!HHIH", rtype, 1, 60, len(rdata)) + rdata
+    return data
+
+
+class FakeConn:
+    def __init__(self, nameservers=("127.0.0.1",), value="192.0.2.1"):
+        self.nameservers = list(nameservers)
+        self.value = value
+        self.reads = 0
+
+    def get_hosted_zone(self, zone_id):
+        return ddns.HostedZone(zone_id, "example.com.", self.nameservers)
+
+    def list_rrsets(self, zone_id, name=None, record_type=None, identifier=None, maxitems=None):
+        self.reads += 1
+        return [ddns.RRSet(name, record_type, 10, [self.value])], None
+
+
+def test_encode_query():
+    query = ddns.encode_dns_query("home.example.com.", ddns.DNS_TYPES["AAAA"], 0x1234, recursion_desired=True)
+    assert struct.unpack_from("!HHHHHH", query) == (0x1234, 0x0100, 1, 0, 0, 0)
+    name, offset = ddns.decode_dns_name(query, 12)
+    assert name == "home.example.com."
+    assert struct.unpack_from("!HH", query, offset) == (ddns.DNS_TYPES["AAAA"], 1)
+    with pytest.raises(ValueError):
+        ddns.encode_dns_name("bad..example.com.")
+
+
+def test_decode_follows_compression_pointers():
+    query = ddns.encode_dns_query("home.example.com.", ddns.DNS_TYPES["A"], 7)
+    # "ns1" followed by a pointer to "example.com." inside the question, at offset 12 + 5
+    ns_rdata = b"\x03ns1\xc0\x11"
+    data = dns_response(query, [(ddns.DNS_TYPES["A"], bytes([192, 0, 2, 1])), (ddns.DNS_TYPES["NS"], ns_rdata),
+                                (ddns.DNS_TYPES["TXT"], b"\x03abc\x02de")])
+    response = ddns.decode_dns_response(data)
+    assert response.id == 7 and response.authoritative and response.rcode == ddns.DNS_NOERROR
+    assert [(answer.name, answer.value) for answer in response.answers] == [
+        ("home.example.com.", "192.0.2.1"), ("home.example.com.", "ns1.example.com."),
+        ("home.example.com.", "abcde")]
+
+
+def test_decode_rejects_compression_loops_and_truncated_rdata():
+    query = ddns.encode_dns_query("home.example.com.", ddns.DNS_TYPES["A"], 7)
+    looped = bytearray(dns_response(query, [(ddns.DNS_TYPES["A"], bytes(4))]))
+    # The answer's name pointer now points at itself
+    answer = len(query)
+    looped[answer:answer + 2] = bytes([0xC0, answer])
+    with pytest.raises(ValueError):
+        ddns.decode_dns_response(bytes(looped))
+
+    truncated = dns_response(query, [(ddns.DNS_TYPES["A"], bytes(4))])[:-2]
+    with pytest.raises(ValueError):
+        ddns.decode_dns_response(truncated)
+
+
+def test_query_ignores_other_transactions_and_garbage(udp_stand_in):
+    def reply(query):
+        return [b"garbage", dns_response(query, [(ddns.DNS_TYPES["A"], bytes([198, 51, 100, 9]))], txid=0),
+                dns_response(query, [(ddns.DNS_TYPES["A"], bytes([192, 0, 2, 1]))])]
+
+    server = udp_stand_in(reply)
+    # txid 0 is one of 65536 random ids, skip the test's one unlucky run rather than flake
+    response = ddns.dns_query("127.0.0.1", "home.example.com.", ddns.DNS_TYPES["A"], 2, port=server.port)
+    if response.id == 0:
+        pytest.skip("the random txid happened to be 0")
+    assert [answer.value for answer in response.answers] == ["192.0.2.1"]
+
+
+def test_query_times_out(udp_stand_in):
+    server = udp_stand_in(lambda query: None)
+    with pytest.raises(OSError):
+        ddns.dns_query("127.0.0.1", "home.example.com.", ddns.DNS_TYPES["A"], 0.2, port=server.port)
+
+
+@pytest.mark.parametrize("reply, expected", [
+    (lambda query: dns_response(query, [(ddns.DNS_TYPES["A"], bytes([192, 0, 2, 1]))]), "192.0.2.1"),
+    (lambda query: dns_response(query, rcode=ddns.DNS_NXDOMAIN), None),
+    # Another type at the name is no value for the record
+    (lambda query: dns_response(query, [(ddns.DNS_TYPES["TXT"], b"\x01x")]), None),
+    (lambda query: dns_response(query, [(ddns.DNS_TYPES["A"], bytes([192, 0, 2, 2])),
+                                        (ddns.DNS_TYPES["A"], bytes([192, 0, 2, 1]))]), "192.0.2.1,192.0.2.2"),
+])
+def test_authoritative_answers(udp_stand_in, reply, expected):
+    server = udp_stand_in(lambda query: [reply(query)])
+    resolver = ddns.AuthoritativeResolver(FakeConn(), timeout=1, port=server.port)
+    assert resolver.get_current_value(RECORD) == expected
+
+
+@pytest.mark.parametrize("reply", [
+    lambda query: dns_response(query, [(ddns.DNS_TYPES["A"], bytes(4))], authoritative=False),
+    lambda query: dns_response(query, rcode=2),
+])
+def test_unusable_answers_fall_back_to_the_api(udp_stand_in, reply):
+    server = udp_stand_in(lambda query: [reply(query)])
+    conn = FakeConn(value="192.0.2.77")
+    resolver = ddns.AuthoritativeResolver(conn, timeout=1, port=server.port)
+    with pytest.raises(ddns.DNSError):
+        resolver.get_current_value(RECORD)
+    assert ddns.read_current_value(conn, resolver, RECORD) == "192.0.2.77"
+    assert conn.reads == 1
+
+
+def test_next_nameserver_answers_when_the_first_is_unusable(udp_stand_in):
+    # Both nameservers are the same stand-in, it only answers authoritatively the second time
+    answers = iter([False, True])
+    server = udp_stand_in(lambda query: [dns_response(query, [(ddns.DNS_TYPES["A"], bytes([192, 0, 2, 1]))],
+                                                      authoritative=next(answers))])
+    conn = FakeConn(nameservers=("127.0.0.1", "localhost"))
+    resolver = ddns.AuthoritativeResolver(conn, timeout=1, port=server.port)
+    resolver.addresses["localhost"] = "127.0.0.1"
+    assert resolver.get_current_value(RECORD) == "192.0.2.1"
+    assert len(server.received) == 2
@@ -0,0 +1,57 @@
+import sys
+import json
+import subprocess
+
+import ddns
+from conftest import ROOT, stun_address, stun_response
+
+# Cumulative microseconds -X importtime reports for "import ddns". Importing boto alone took
+# longer than this before the built-in Route53 client.
+IMPORT_BUDGET_US = 60000
+
+# Only imported once a check needs them, never by "import ddns" itself
+HEAVY_MODULES = ("asyncio", "logging", "concurrent.futures", "requests", "xml.etree.ElementTree",
+                 "hashlib", "hmac")
+
+
+def run_python(code, *flags):
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                          check=True)
+
+
+def test_import_within_budget():
+    # Byte compiled first, so this measures the imports and not compiling the script (which
+    # PYTHONDONTWRITEBYTECODE would otherwise repeat on every run). The best of a few runs, the
+    # others only measure how busy the machine is.
+    run_python("import py_compile; py_compile.compile('ddns.py')")
+    timings = []
+    for _ in range(3):
+        stderr = run_python("import ddns", "-X", "importtime").stderr
+        line = [line for line in stderr.splitlines() if line.rstrip().endswith("| ddns")][-1]
+        timings.append(int(line.split("|")[1]))
+    assert min(timings) < IMPORT_BUDGET_US, f"import ddns took {min(timings)}us"
+
+
+def test_import_leaves_heavy_modules_out():
+    code = f"import sys, ddns; print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    assert run_python(code).stdout.strip() == "[]"
+
+
+def test_cached_run_imports_neither_requests_nor_xml(tmp_path, udp_stand_in):
+    # The address comes from a STUN stand-in and matches the state file, so the run makes no
+    # HTTP request and no Route53 call
+    stun = udp_stand_in(lambda data: [stun_response(data[8:20], stun_address(ddns.STUN_XOR_MAPPED_ADDRESS,
+                                                                             "198.51.100.7", data[8:20]))])
+    state_path = str(tmp_path / "state.json")
+    state = ddns.StateFile(state_path)
+    state.set(ddns.Record("Z0123", "home.example.com.", "A", 10), "198.51.100.7")
+    state.save()
+
+    argv = ["-z", "Z0123", "-d", "home.example.com", "-q", f"stun://127.0.0.1:{stun.port}",
+            "-f", state_path, "-a", "key", "-s", "secret"]
+    code = ("import sys, json, ddns\n"
+            f"results = ddns.Updater(ddns.parse_args({argv!r})).sync()\n"
+            "print(json.dumps({'statuses': [result.status for result in results],\n"
+            "                  'modules': [m for m in ('requests', 'xml.etree.ElementTree') if m in sys.modules]}))")
+    output = json.loads(run_python(code).stdout)
+    assert output == {"statuses": ["cached"], "modules": []}
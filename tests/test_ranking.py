@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+import ddns
+from conftest import stun_address, stun_response
+
+
+def stun_provider(udp_stand_in, ip):
+    return udp_stand_in(lambda data: [stun_response(data[8:20], stun_address(ddns.STUN_XOR_MAPPED_ADDRESS,
+                                                                             ip, data[8:20]))])
+
+
+@pytest.mark.parametrize("age, probed", [(ddns.RANK_PROBE_AGE + 60, True), (60, False)])
+def test_fresh_process_probes_a_stale_demoted_provider(udp_stand_in, age, probed):
+    # As a one-shot run from cron would be: the first lookup of the process, with the ranking
+    # loaded from the state file where the fallback failed age seconds ago
+    best, demoted = stun_provider(udp_stand_in, "198.51.100.7"), stun_provider(udp_stand_in, "198.51.100.7")
+    urls = [f"stun://127.0.0.1:{best.port}", f"stun://127.0.0.1:{demoted.port}"]
+    discovery = ddns.IPDiscovery(None, urls, 4, timeout=1, strategy="ranked")
+    discovery.load_ranking({urls[0]: {"latency": 0.01, "failure": 0.0, "updated": time.time()},
+                            urls[1]: {"latency": 0.01, "failure": 1.0, "updated": time.time() - age}})
+
+    assert discovery.lookup() == "198.51.100.7"
+    deadline = time.monotonic() + 1
+    while probed and not demoted.received and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert bool(demoted.received) == probed
+    assert len(best.received) == 1
@@ -0,0 +1,82 @@
+import json
+
+from ddns import HostedZone, RRSet, chunk_groups, diff_zone, main
+
+APEX = "example.com."
+
+
+def test_diff_zone_groups_changes_per_name_and_deletes_last():
+    zone = [
+        RRSet("example.com.", "NS", 172800, ["ns-1.awsdns.net."]),
+        RRSet("example.com.", "SOA", 900, ["ns-1.awsdns.net. hostmaster. 1 7200 900 1209600 86400"]),
+        RRSet("gone.example.com.", "A", 300, ["192.0.2.1"]),
+        RRSet("same.example.com.", "A", 300, ["192.0.2.2"]),
+        RRSet("swap.example.com.", "A", 300, ["192.0.2.3"]),
+        RRSet("ttl.example.com.", "A", 300, ["192.0.2.4"]),
+        RRSet("\\052.example.com.", "A", 300, ["192.0.2.5"]),
+    ]
+    desired = {(rrset.name, rrset.type): rrset for rrset in [
+        RRSet("same.example.com.", "A", 300, ["192.0.2.2"]),
+        RRSet("swap.example.com.", "CNAME", 300, ["same.example.com."]),
+        RRSet("ttl.example.com.", "A", 60, ["192.0.2.4"]),
+        RRSet("*.example.com.", "A", 300, ["192.0.2.5"]),
+        RRSet("new.example.com.", "A", 300, ["192.0.2.6"]),
+    ]}
+
+    groups = diff_zone(zone, desired, APEX)
+
+    assert [[(action, rrset.name, rrset.type) for action, rrset in group] for group in groups] == [
+        [("UPSERT", "ttl.example.com.", "A")],
+        [("UPSERT", "new.example.com.", "A")],
+        [("DELETE", "swap.example.com.", "A"), ("UPSERT", "swap.example.com.", "CNAME")],
+        [("DELETE", "gone.example.com.", "A")],
+    ]
+
+
+def test_chunk_groups_never_splits_a_group(monkeypatch):
+    monkeypatch.setattr("ddns.R53_MAX_CHANGES", 3)
+    single = [("UPSERT", RRSet("a.example.com.", "A", 300, ["192.0.2.1"]))]
+    pair = [("DELETE", RRSet("swap.example.com.", "A", 300, ["192.0.2.3"])),
+            ("UPSERT", RRSet("swap.example.com.", "CNAME", 300, ["same.example.com."]))]
+
+    batches = list(chunk_groups([single, single, pair, single]))
+
+    assert batches == [single + single, pair + single]
+
+
+def test_chunk_groups_counts_upsert_values_twice(monkeypatch):
+    monkeypatch.setattr("ddns.R53_MAX_VALUES", 4)
+    upsert = [("UPSERT", RRSet("a.example.com.", "A", 300, ["192.0.2.1"]))]
+    delete = [("DELETE", RRSet("b.example.com.", "A", 300, ["192.0.2.2"]))]
+
+    assert list(chunk_groups([upsert, upsert, delete])) == [upsert + upsert, delete]
+
+
+class StaticZone:
+    def __init__(self, rrsets):
+        self.rrsets = rrsets
+
+    def get_hosted_zone(self, zone_id):
+        return HostedZone(zone_id, APEX, [])
+
+    def list_rrsets(self, zone_id, name=None, record_type=None, identifier=None, maxitems=None):
+        return self.rrsets, None
+
+    def change_rrsets(self, zone_id, changes, comment=None):
+        raise AssertionError("a dry run changed the zone")
+
+
+def test_json_dry_run_lists_the_plan(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "desired.json"
+    path.write_text(json.dumps({"zone_id": "Z0123", "ttl": 300, "records": [
+        {"fqdn": "swap.example.com.", "type": "CNAME", "values": ["www.example.com."]}]}))
+    zone = StaticZone([RRSet("swap.example.com.", "A", 300, ["192.0.2.3"])])
+    monkeypatch.setattr("ddns.make_client", lambda *args, **kwargs: zone)
+
+    main(["--reconcile", str(path), "--dry-run", "--log-format", "json", "-a", "key", "-s", "secret"])
+
+    line = json.loads(capsys.readouterr().out)
+    assert line["plan"] == [
+        {"action": "DELETE", "name": "swap.example.com.", "type": "A", "ttl": 300, "values": ["192.0.2.3"]},
+        {"action": "UPSERT", "name": "swap.example.com.", "type": "CNAME", "ttl": 300, "values": ["www.example.com."]},
+    ]
@@ -0,0 +1,169 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import ddns
+
+# The AWS SigV4 test suite's credentials, host and time
+ACCESS_KEY = "AKIDEXAMPLE"
+SECRET_KEY = "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY"
+SIGNED_AT = datetime(2015, 8, 30, 12, 36, 0, tzinfo=timezone.utc)
+
+LIST_RESPONSE = (f'<?xml version="1.0"?>\n<ListResourceRecordSetsResponse xmlns="{ddns.R53_XMLNS[1:-1]}">'
+                 f'<ResourceRecordSets/><IsTruncated>false</IsTruncated></ListResourceRecordSetsResponse>').encode()
+
+CHANGE_RESPONSE = (f'<?xml version="1.0"?>\n<ChangeResourceRecordSetsResponse xmlns="{ddns.R53_XMLNS[1:-1]}">'
+                   f'<ChangeInfo><Id>/change/C0123</Id><Status>PENDING</Status></ChangeInfo>'
+                   f'</ChangeResourceRecordSetsResponse>').encode()
+
+
+class Response:
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode()
+
+
+class RecordingSession:
+    # Stands in for the requests session, answering each request with the next of responses
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, data=None, headers=None, timeout=None):
+        self.requests.append((method, url, headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return SIGNED_AT
+
+
+@pytest.fixture
+def signed_at(monkeypatch):
+    monkeypatch.setattr("ddns.datetime", FixedDatetime)
+
+
+@pytest.mark.parametrize("method, query, signature", [
+    # get-vanilla, get-vanilla-query-order-key-case and post-vanilla
+    ("GET", "", "5fa00fa31553b73ebf1942676e86291e8372ff2a2260956d9b8aae1d763fbf31"),
+    ("GET", "Param1=value1&Param2=value2", "b97d918cfa904a5beff61c982a1b6f458b799221646efd99d3219ec94cdf2500"),
+    ("POST", "", "5da7c1a2acd57cee7505fc6676e4e544621c30862966e37dddb68e92efbe5d6b"),
+])
+def test_sign_matches_the_sigv4_test_suite(monkeypatch, signed_at, method, query, signature):
+    monkeypatch.setattr("ddns.R53_SERVICE", "service")
+    client = ddns.Route53Client(ACCESS_KEY, SECRET_KEY, "https://example.amazonaws.com")
+
+    headers = client._sign(method, "/", query, b"")
+
+    assert headers == {
+        "X-Amz-Date": "20150830T123600Z",
+        "Authorization": "AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/20150830/us-east-1/service/aws4_request, "
+                         f"SignedHeaders=host;x-amz-date, Signature={signature}",
+    }
+
+
+def test_list_request_is_encoded_and_signed(signed_at):
+    client = ddns.Route53Client(ACCESS_KEY, SECRET_KEY)
+    client.session = RecordingSession(Response(200, LIST_RESPONSE))
+
+    client.list_rrsets("/hostedzone/Z0123", "*.home.example.com.", "A", maxitems=1)
+
+    # The signature was checked against a separate SigV4 implementation, it only changes if the
+    # canonical request does
+    method, url, headers = client.session.requests[0]
+    assert url == ("https://route53.amazonaws.com/2013-04-01/hostedzone/Z0123/rrset"
+                   "?maxitems=1&name=%2A.home.example.com.&type=A")
+    assert headers["Authorization"] == (
+        "AWS4-HMAC-SHA256 Credential=AKIDEXAMPLE/20150830/us-east-1/route53/aws4_request, "
+        "SignedHeaders=host;x-amz-date, Signature=2542cf3315097367902d8d889b82d7383a4d3c44873b57fde68526ff4eba686b")
+
+
+def throttling():
+    return Response(400, (f'<?xml version="1.0"?>\n<ErrorResponse xmlns="{ddns.R53_XMLNS[1:-1]}"><Error>'
+                          f'<Type>Sender</Type><Code>Throttling</Code><Message>Rate exceeded</Message>'
+                          f'</Error></ErrorResponse>').encode())
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr("ddns.time.sleep", delays.append)
+    return delays
+
+
+def test_throttled_call_is_retried(sleeps):
+    client = ddns.Route53Client(ACCESS_KEY, SECRET_KEY)
+    client.session = RecordingSession(throttling(), throttling(), Response(200, LIST_RESPONSE))
+
+    assert client.list_rrsets("Z0123") == ([], None)
+    assert client.counters == {"calls": 3, "throttles": 2, "retries": 2}
+    assert len(sleeps) == 2 and all(ddns.R53_RETRY_BASE <= delay <= ddns.R53_RETRY_CAP for delay in sleeps)
+
+
+def test_retries_stop_after_max_retries(sleeps):
+    client = ddns.Route53Client(ACCESS_KEY, SECRET_KEY, max_retries=2)
+    client.session = RecordingSession(*(throttling() for _ in range(4)))
+
+    with pytest.raises(ddns.Route53Error, match="Throttling"):
+        client.list_rrsets("Z0123")
+    assert client.counters == {"calls": 3, "throttles": 3, "retries": 2}
+    assert len(client.session.responses) == 1
+
+
+DELETE = [("DELETE", ddns.RRSet("old.example.com.", "A", 60, ["192.0.2.1"]))]
+
+
+def test_post_is_not_retried_once_it_may_have_been_applied(sleeps):
+    # A read timeout may come after Route53 applied the change, sending a DELETE again would fail
+    client = ddns.Route53Client(ACCESS_KEY, SECRET_KEY)
+    client.session = RecordingSession(TimeoutError("read timed out"), Response(200, CHANGE_RESPONSE))
+
+    with pytest.raises(TimeoutError):
+        client.change_rrsets("Z0123", DELETE)
+    assert len(client.session.requests) == 1
+
+
+def test_post_is_retried_when_it_never_connected(sleeps):
+    client = ddns.Route53Client(ACCESS_KEY, SECRET_KEY)
+    client.session = RecordingSession(ConnectionRefusedError("refused"), Response(200, CHANGE_RESPONSE))
+
+    assert client.change_rrsets("Z0123", DELETE) == ddns.ChangeInfo("C0123", "PENDING")
+    assert len(client.session.requests) == 2
+
+
+def test_requests_connect_errors_are_told_apart():
+    requests = pytest.importorskip("requests")
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+    refused = requests.exceptions.ConnectionError(MaxRetryError(None, "/", NewConnectionError(None, "refused")))
+    assert ddns.connect_failed(refused)
+    assert ddns.connect_failed(requests.exceptions.ConnectTimeout())
+    assert not ddns.connect_failed(requests.exceptions.ReadTimeout())
+    assert not ddns.connect_failed(requests.exceptions.ConnectionError("Connection aborted."))
+
+
+class Slept(Exception):
+    pass
+
+
+def test_file_token_bucket_is_shared(tmp_path, monkeypatch):
+    # Two buckets on one file, as two processes would be, draw from the same two tokens
+    path = str(tmp_path / "bucket")
+    first, second = ddns.FileTokenBucket(path, 1, burst=2), ddns.FileTokenBucket(path, 1, burst=2)
+    first.acquire()
+    second.acquire()
+
+    def sleep(seconds):
+        assert 0.9 < seconds <= 1
+        raise Slept()
+
+    monkeypatch.setattr("ddns.time.sleep", sleep)
+    with pytest.raises(Slept):
+        first.acquire()
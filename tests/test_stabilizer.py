@@ -0,0 +1,83 @@
+import pytest
+
+import ddns
+
+KEY = "Z0123/home.example.com./A"
+A, B, C = "198.51.100.1", "198.51.100.2", "198.51.100.3"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Wall clock seconds as Stabilizer sees them, moved forward by hand
+    now = [1000000.0]
+    monkeypatch.setattr("ddns.time.time", lambda: now[0])
+    return now
+
+
+def test_commits_after_enough_checks_and_seconds(clock):
+    stabilizer = ddns.Stabilizer(3, 60)
+
+    assert not stabilizer.observe(KEY, B)
+    clock[0] += 30
+    assert not stabilizer.observe(KEY, B)
+    clock[0] += 30
+    # Three checks over 60 seconds
+    assert stabilizer.observe(KEY, B)
+    assert stabilizer.data["pending"] == {}
+    assert stabilizer.flaps() == 0
+
+
+def test_checks_alone_are_not_enough(clock):
+    stabilizer = ddns.Stabilizer(2, 60)
+
+    assert not stabilizer.observe(KEY, B)
+    clock[0] += 10
+    assert not stabilizer.observe(KEY, B)
+    assert stabilizer.describe(KEY) == "seen 2/2 checks over 10s"
+    clock[0] += 50
+    assert stabilizer.observe(KEY, B)
+
+
+def test_flap_back_drops_the_pending_address(clock):
+    # A -> B -> A: the record still holds A, B is forgotten and counted as a flap
+    stabilizer = ddns.Stabilizer(2, 0)
+
+    assert not stabilizer.observe(KEY, B)
+    stabilizer.settle(KEY)
+    assert stabilizer.data["pending"] == {}
+    assert stabilizer.flaps() == 1
+    # B starts over from the first check
+    assert not stabilizer.observe(KEY, B)
+
+
+def test_another_address_restarts_the_count(clock):
+    stabilizer = ddns.Stabilizer(2, 0)
+
+    assert not stabilizer.observe(KEY, B)
+    assert not stabilizer.observe(KEY, C)
+    assert stabilizer.flaps() == 1
+    assert stabilizer.observe(KEY, C)
+
+
+def test_pending_addresses_survive_across_runs(tmp_path, clock):
+    # As one-shot runs would: each check is a new process with its own Stabilizer on the state file
+    path = str(tmp_path / "state.json")
+    for _ in range(2):
+        state = ddns.StateFile(path)
+        assert not ddns.Stabilizer(3, 60, state).observe(KEY, B)
+        assert state.dirty
+        state.save()
+        clock[0] += 30
+
+    state = ddns.StateFile(path)
+    stabilizer = ddns.Stabilizer(3, 60, state)
+    assert stabilizer.describe(KEY) == "seen 2/3 checks over 60s"
+    assert stabilizer.observe(KEY, B)
+    # Then a flap to C and back
+    assert not stabilizer.observe(KEY, C)
+    stabilizer.settle(KEY)
+    state.save()
+
+    stabilizer = ddns.Stabilizer(3, 60, ddns.StateFile(path))
+    assert stabilizer.data["pending"] == {}
+    assert stabilizer.flaps() == 1
@@ -0,0 +1,58 @@
+import os
+import time
+import socket
+
+import pytest
+
+import ddns
+from conftest import stun_address, stun_response
+
+TRANSACTION = bytes(range(12))
+
+
+@pytest.mark.parametrize("ip", ["198.51.100.7", "2001:db8::7"])
+def test_xor_mapped_address(ip):
+    response = stun_response(TRANSACTION, stun_address(ddns.STUN_XOR_MAPPED_ADDRESS, ip, TRANSACTION))
+    assert ddns.decode_stun_response(response, TRANSACTION) == ip
+
+
+def test_mapped_address_fallback():
+    response = stun_response(TRANSACTION, stun_address(ddns.STUN_MAPPED_ADDRESS, "198.51.100.8", TRANSACTION))
+    assert ddns.decode_stun_response(response, TRANSACTION) == "198.51.100.8"
+
+
+def test_xor_mapped_address_wins_over_mapped_address():
+    response = stun_response(TRANSACTION, stun_address(ddns.STUN_MAPPED_ADDRESS, "10.0.0.1", TRANSACTION),
+                             stun_address(ddns.STUN_XOR_MAPPED_ADDRESS, "198.51.100.7", TRANSACTION))
+    assert ddns.decode_stun_response(response, TRANSACTION) == "198.51.100.7"
+
+
+def test_other_transactions_and_messages_are_ignored():
+    attribute = stun_address(ddns.STUN_XOR_MAPPED_ADDRESS, "198.51.100.7", TRANSACTION)
+    assert ddns.decode_stun_response(stun_response(TRANSACTION, attribute), bytes(12)) is None
+    assert ddns.decode_stun_response(stun_response(TRANSACTION, attribute, msg_type=0x0111), TRANSACTION) is None
+    assert ddns.decode_stun_response(b"short", TRANSACTION) is None
+
+
+def test_query_retransmits_after_a_lost_request(udp_stand_in):
+    def reply(request):
+        # The first request is lost, the second gets an answer to another transaction first
+        if len(server.received) == 1:
+            return None
+        transaction = request[8:20]
+        return [stun_response(os.urandom(12), stun_address(ddns.STUN_XOR_MAPPED_ADDRESS, "10.0.0.1", transaction)),
+                stun_response(transaction, stun_address(ddns.STUN_XOR_MAPPED_ADDRESS, "198.51.100.7", transaction))]
+
+    server = udp_stand_in(reply)
+    start = time.monotonic()
+    assert ddns.stun_query("127.0.0.1", server.port, 4, 5) == "198.51.100.7"
+    assert len(server.received) == 2
+    assert server.received[0] == server.received[1]
+    # The retransmission waited for the initial RTO
+    assert time.monotonic() - start >= ddns.STUN_INITIAL_RTO
+
+
+def test_query_times_out(udp_stand_in):
+    server = udp_stand_in(lambda request: None)
+    with pytest.raises(socket.timeout):
+        ddns.stun_query("127.0.0.1", server.port, 4, 0.3)
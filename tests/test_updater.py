@@ -0,0 +1,85 @@
+import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ddns
+from conftest import stun_address, stun_response
+
+
+def write_records(tmp_path, records):
+    path = tmp_path / "records.json"
+    path.write_text(json.dumps({"records": records}))
+    return str(path)
+
+
+@pytest.mark.parametrize("records, error", [
+    ([], "no records configured"),
+    ([{"zone_id": "Z0123", "type": "A"}], "missing 'fqdn'"),
+    ([{"zone_id": "Z0123", "fqdn": "home.example.com.", "type": "MX"}], "unsupported record type MX"),
+    ([{"zone_id": "Z0123", "fqdn": "home.example.com.", "account": "prod"}], "undefined account prod"),
+    ([{"zone_id": "Z0123", "fqdn": "home.example.com.", "type": ["A", "AAAA"]},
+      {"zone_id": "Z0123", "fqdn": "Home.example.com", "type": "A"}], "home.example.com. A is listed twice"),
+])
+def test_bad_config_raises_config_error(tmp_path, records, error):
+    args = ddns.parse_args(["--config", write_records(tmp_path, records), "-a", "key", "-s", "secret"])
+    with pytest.raises(ddns.ConfigError, match=error):
+        ddns.Updater(args)
+
+
+@pytest.mark.parametrize("name, content, error", [
+    ("records.json", "{", "records.json: Expecting property name"),
+    ("records.toml", "[[records]", "records.toml: "),
+    ("records.json", "[]", "expected a mapping"),
+    ("missing.json", None, "No such file or directory"),
+])
+def test_unreadable_config_raises_config_error(tmp_path, name, content, error):
+    path = tmp_path / name
+    if content is not None:
+        path.write_text(content)
+    with pytest.raises(ddns.ConfigError, match=error):
+        ddns.load_config(str(path))
+
+
+def test_missing_credentials_raise_config_error(monkeypatch):
+    monkeypatch.delenv("AWS_ACCESS_KEY_ID", raising=False)
+    monkeypatch.delenv("AWS_SECRET_ACCESS_KEY", raising=False)
+    with pytest.raises(ddns.ConfigError, match="--aws-access-key-id"):
+        ddns.Updater(ddns.parse_args(["-z", "Z0123", "-d", "home.example.com"]))
+
+
+def test_main_exits_on_config_error(tmp_path):
+    with pytest.raises(SystemExit, match="no records configured"):
+        ddns.main(["--config", write_records(tmp_path, []), "-a", "key", "-s", "secret"])
+
+
+def test_sync_async_runs_inside_an_event_loop(tmp_path, udp_stand_in):
+    stun = udp_stand_in(lambda data: [stun_response(data[8:20], stun_address(ddns.STUN_XOR_MAPPED_ADDRESS,
+                                                                             "198.51.100.7", data[8:20]))])
+    state_path = str(tmp_path / "state.json")
+    state = ddns.StateFile(state_path)
+    state.set(ddns.Record("Z0123", "home.example.com.", "A", 10), "198.51.100.7")
+    state.save()
+    updater = ddns.Updater(ddns.parse_args(["-z", "Z0123", "-d", "home.example.com", "-f", state_path,
+                                            "-q", f"stun://127.0.0.1:{stun.port}", "-a", "key", "-s", "secret"]))
+
+    host_executor = ThreadPoolExecutor(max_workers=1)
+
+    async def embedded():
+        # Where updater.sync() would fail, asyncio.run() can't be nested
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(host_executor)
+        results = await updater.sync_async(), await updater.check_async()
+        # The checks ran on the updater's threads, the host's default executor is left alone
+        assert await loop.run_in_executor(None, threading.current_thread) in host_executor._threads
+        return results
+
+    try:
+        synced, checked = asyncio.run(embedded())
+    finally:
+        updater.close()
+    assert [result.status for result in synced] == ["cached"]
+    assert [result.new for result in checked] == ["198.51.100.7"]
+    assert updater.executor is None
@@ -0,0 +1,50 @@
+from ddns import Record, RRSet, get_current_value, read_zone_values
+
+
+class PagedZone:
+    # ListResourceRecordSets over a sorted zone, page_size record sets from the given name on
+
+    def __init__(self, rrsets, page_size):
+        self.rrsets = sorted(rrsets, key=lambda rrset: self.order(rrset.name, rrset.type))
+        self.page_size = page_size
+        self.calls = 0
+
+    @staticmethod
+    def order(name, record_type):
+        return tuple(reversed(name.rstrip(".").split("."))), record_type
+
+    def list_rrsets(self, zone_id, name=None, record_type=None, identifier=None, maxitems=None):
+        self.calls += 1
+        start = self.order(name.replace("*", "\\052"), record_type)
+        rest = [rrset for rrset in self.rrsets if self.order(rrset.name, rrset.type) >= start]
+        return rest[:self.page_size], None
+
+
+def test_records_close_together_share_a_page():
+    zone = PagedZone([RRSet(f"h{i:02}.example.com.", "A", 60, [f"192.0.2.{i}"]) for i in range(40)], page_size=10)
+    records = [Record("Z0123", f"h{i:02}.example.com.", "A", 60) for i in range(0, 40, 2)]
+
+    values = read_zone_values(zone, "Z0123", records)
+
+    assert values == {(record.fqdn, record.type): f"192.0.2.{int(record.fqdn[1:3])}" for record in records}
+    assert zone.calls == 4
+
+
+def test_missing_records_and_wildcards():
+    zone = PagedZone([RRSet("a.example.com.", "A", 60, ["192.0.2.1"]),
+                      RRSet("a.example.com.", "AAAA", 60, ["2001:DB8:0:0::1"]),
+                      RRSet("\\052.example.com.", "A", 60, ["192.0.2.2"]),
+                      RRSet("z.example.com.", "A", 60, ["192.0.2.3"])], page_size=2)
+    records = [Record("Z0123", "a.example.com.", "A", 60), Record("Z0123", "a.example.com.", "AAAA", 60),
+               Record("Z0123", "b.example.com.", "A", 60), Record("Z0123", "*.example.com.", "A", 60)]
+
+    values = read_zone_values(zone, "Z0123", records)
+
+    assert values == {("a.example.com.", "A"): "192.0.2.1", ("a.example.com.", "AAAA"): "2001:db8::1",
+                      ("b.example.com.", "A"): None, ("*.example.com.", "A"): "192.0.2.2"}
+
+
+def test_single_record_read_matches_a_wildcard():
+    zone = PagedZone([RRSet("\\052.home.example.com.", "A", 60, ["192.0.2.2"])], page_size=1)
+
+    assert get_current_value(zone, Record("Z0123", "*.home.example.com.", "A", 60)) == "192.0.2.2"